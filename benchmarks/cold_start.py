@@ -0,0 +1,86 @@
+import os
+import sys
+import json
+import time
+import argparse
+import statistics
+import subprocess
+
+BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+# точки входа: запуск всего пайплайна, демон и запуск одного этапа через __main__
+TARGETS = [
+    'src.main',
+    'src.daemon',
+    'src.data_extraction_and_processing.ya.ya_get_cars_and_bookings_data',
+    'src.data_extraction_and_processing.takamol.takamol_data_matcher',
+    'src.data_extraction_and_processing.docs_google.google_sheets_client',
+]
+HEAVY_MODULES = ['pandas', 'numpy', 'requests', 'gspread', 'oauth2client', 'pyarrow']
+SLOWEST_IMPORTS = 5
+
+
+def run_import(module_name):
+    # каждый замер - новый интерпретатор, иначе модули уже лежат в sys.modules
+    code = (f"import sys, time; started = time.perf_counter(); import {module_name}; "
+            f"print(time.perf_counter() - started); "
+            f"print(','.join(name for name in {HEAVY_MODULES!r} if name in sys.modules))")
+    started = time.perf_counter()
+    completed = subprocess.run([sys.executable, '-X', 'importtime', '-c', code], cwd=BASE_DIR,
+                               capture_output=True, text=True, check=True)
+    total = time.perf_counter() - started
+    import_seconds, heavy = completed.stdout.splitlines()
+    return total, float(import_seconds), heavy.split(',') if heavy else [], parse_importtime(completed.stderr)
+
+
+def parse_importtime(output):
+    # строки вида "import time: self [us] | cumulative | module"; пакеты верхнего уровня на любой глубине -
+    # по ним видно, кто тянет pandas, gspread и т.п.
+    imports = []
+    for line in output.splitlines():
+        if not line.startswith('import time:') or 'cumulative' in line:
+            continue
+        _, cumulative, module_name = line[len('import time:'):].split('|')
+        module_name = module_name.strip()
+        if '.' not in module_name and not module_name.startswith('_') and module_name not in ('site', 'encodings'):
+            imports.append((module_name, int(cumulative) / 1e6))
+    return sorted(imports, key=lambda item: item[1], reverse=True)[:SLOWEST_IMPORTS]
+
+
+def measure(module_name, repeat):
+    runs = [run_import(module_name) for _ in range(repeat)]
+    return {
+        'module': module_name,
+        'process_seconds': statistics.median(run[0] for run in runs),
+        'import_seconds': statistics.median(run[1] for run in runs),
+        'heavy_modules': runs[-1][2],
+        'slowest_imports': runs[-1][3],
+    }
+
+
+def print_result(result):
+    print(f"{result['module']:<72} process {result['process_seconds']:>6.3f}s "
+          f"import {result['import_seconds']:>6.3f}s heavy: {','.join(result['heavy_modules']) or '-'}", flush=True)
+    for module_name, seconds in result['slowest_imports']:
+        print(f"    {module_name:<68} {seconds:>6.3f}s")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Холодный старт: время запуска интерпретатора и импорта точек входа")
+    parser.add_argument('--modules', nargs='+', default=TARGETS)
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--output', help="путь для json с результатами")
+    args = parser.parse_args(argv)
+
+    results = []
+    for module_name in args.modules:
+        result = measure(module_name, args.repeat)
+        print_result(result)
+        results.append(result)
+    if args.output:
+        with open(args.output, mode='w', encoding='utf-8') as file:
+            json.dump(results, file, indent=4)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
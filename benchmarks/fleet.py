@@ -0,0 +1,126 @@
+import random
+from datetime import datetime, timedelta
+import pandas as pd
+
+DUBAI_DATETIME_FORMAT = '%m/%d/%Y %I:%M:%S %p'
+PLATE_LETTERS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ'
+EMIRATES = ['Dubai', 'Abu Dhabi', 'AD', 'Sharjah', 'RAK', '']
+
+# (manufacturer, модель, варианты написания у арендодателей - в том числе опечатки из normalize_string)
+MANUFACTURERS = [
+    ('Lamborghini', 'Huracan', ['Lamborghini Huracan', 'Lambo Hurracan', 'Lamborgini Hurcan']),
+    ('Lamborghini', 'Urus', ['Lamborghini Urus', 'Lambo Urus']),
+    ('Rolls Royce', 'Cullinan', ['Rolls Royce Cullinan', 'Rolls-Royse Culinnan']),
+    ('Bentley', 'Bentayga', ['Bentley Bentayga', 'Bentley Bentaga']),
+    ('Porsche', 'Cayenne', ['Porsche Cayenne', 'Posche Cayean']),
+    ('Chevrolet', 'Tahoe', ['Chevrolet Tahoe', 'Chevrolete Tahoe']),
+    ('Land Rover', 'Range Rover', ['Land Rover Range Rover', 'Land Rover Rang Rov']),
+    ('Hyundai', 'Santa Fe', ['Hundai Santa Fe H', 'Hyundai Santa Fe']),
+    ('Nissan', 'Patrol', ['Nissan Patrol']),
+    ('Kia', 'Carnival', ['Kia Carnival']),
+]
+
+
+def make_plate(rng):
+    letters = rng.choice(PLATE_LETTERS) if rng.random() < 0.8 else rng.choice(PLATE_LETTERS) * 2
+    return letters, str(rng.randint(1, 99999))
+
+
+def format_plate(rng, letters, digits):
+    # одни и те же номера в разных источниках записаны по-разному
+    emirate = rng.choice(EMIRATES)
+    separator = rng.choice([' ', '-', '', ' - '])
+    plate = f'{letters}{separator}{digits}' if rng.random() < 0.7 else f'{digits}{separator}{letters}'
+    return f'{emirate} {plate}'.strip()
+
+
+def timestamp(moment):
+    return int(moment.timestamp())
+
+
+def generate_fleet(cars_count, seed=0, bookings_per_car=6, reservations_per_car=4, horizon_days=180):
+    rng = random.Random(seed)
+    now = datetime.now().replace(minute=0, second=0, microsecond=0)
+
+    models = [{'code': f'model-{index}', 'manufacturer': manufacturer, 'short_name': short_name,
+               'name': f'{manufacturer} {short_name}', 'model_specifications': []}
+              for index, (manufacturer, short_name, _) in enumerate(MANUFACTURERS)]
+
+    cars, bookings, takamol, sheet = [], [], [], []
+    plates = []
+    for index in range(cars_count):
+        model_index = rng.randrange(len(MANUFACTURERS))
+        letters, digits = make_plate(rng)
+        year = rng.randint(2019, 2025)
+        if plates and rng.random() < 0.05:
+            # одинаковые цифры в разных эмиратах и повторы номера у той же или другой модели -
+            # источник неоднозначных мэтчей
+            previous_letters, digits, previous_model_index, previous_year = rng.choice(plates)
+            letters = previous_letters if rng.random() < 0.5 else letters
+            model_index = previous_model_index if rng.random() < 0.5 else model_index
+            year = previous_year if rng.random() < 0.5 else year
+        plates.append((letters, digits, model_index, year))
+        manufacturer, short_name, aliases = MANUFACTURERS[model_index]
+        car_id = f'car-{index:06d}'
+        specifications = [{'name': 'Year', 'value': str(year)}]
+        cars.append({'id': car_id, 'number': f'{letters}{digits}', 'model_id': f'model-{model_index}',
+                     'model_specifications': specifications,
+                     # так колонка выглядит после join с каталогом моделей и чтения из csv
+                     'merge_manufacturer': manufacturer, 'merge_short_name': short_name,
+                     'merge_name': f'{manufacturer} {short_name}', 'model_specifications_x': str(specifications)})
+
+        # плотное расписание ya: брони идут подряд с небольшими промежутками, часть касается друг друга
+        moment = now - timedelta(days=10) + timedelta(hours=rng.randint(0, 48))
+        for _ in range(rng.randint(0, 2 * bookings_per_car)):
+            until = moment + timedelta(hours=rng.randint(4, 96))
+            bookings.append({'since': timestamp(moment), 'until': timestamp(until),
+                             'status_title': rng.choice(['rental.status.active.title',
+                                                         'rental.status.on_hold.title']), 'id_car': car_id})
+            moment = until + timedelta(hours=rng.choice([0, 0, 2, 12, 48]))
+            if moment > now + timedelta(days=horizon_days):
+                break
+
+        reservations = []
+        for _ in range(rng.randint(0, 2 * reservations_per_car)):
+            since = now + timedelta(days=rng.randint(-5, horizon_days), hours=rng.randint(0, 23))
+            until = since + timedelta(days=rng.randint(1, 7))
+            reservations.append({'FromDateTime': since.strftime(DUBAI_DATETIME_FORMAT),
+                                 'ToDateTime': until.strftime(DUBAI_DATETIME_FORMAT)})
+        if rng.random() < 0.9:
+            takamol.append({'CarKey': 100000 + index, 'CarNo': digits if rng.random() < 0.7 else f'{letters}{digits}',
+                            'CarName': rng.choice(aliases), 'Model': year, 'MemberNo': 1,
+                            'Reservations': str(reservations)})
+        if rng.random() < 0.9:
+            sheet.append({'Plate No': format_plate(rng, letters, digits),
+                          'Vehicle Type': f'{rng.choice(aliases)} {year}',
+                          'Status': rng.choice(['Booked', 'Available', 'Maintenance'])})
+
+    # мусорные строки, которые матчер должен отбросить
+    for _ in range(max(1, cars_count // 100)):
+        sheet.append({'Plate No': rng.choice(['', '???', 'TBD', 'Dubai']), 'Vehicle Type': 'unknown',
+                      'Status': 'Booked'})
+
+    yango_cars = pd.DataFrame(cars)
+    return {
+        'models': models,
+        'raw_yango_cars': yango_cars[['id', 'number', 'model_id', 'model_specifications']],
+        'yango_cars': yango_cars,
+        'bookings': pd.DataFrame(bookings, columns=['since', 'until', 'status_title', 'id_car']),
+        'takamol': pd.DataFrame(takamol),
+        'sheet': pd.DataFrame(sheet),
+    }
+
+
+def generate_requested_intervals(fleet, seed=0):
+    # запрошенные холды: по несколько пересекающихся интервалов на авто, как после разбора броней takamol
+    rng = random.Random(seed)
+    rows = []
+    for row, car_id in enumerate(fleet['yango_cars']['id']):
+        intervals = []
+        for _ in range(rng.randint(1, 6)):
+            since = timestamp(datetime.now()) + rng.randint(-5 * 86400, 180 * 86400) // 3600 * 3600
+            until = since + rng.randint(1, 96) * 3600
+            intervals.append((since, until, datetime.fromtimestamp(since).strftime(DUBAI_DATETIME_FORMAT),
+                              datetime.fromtimestamp(until).strftime(DUBAI_DATETIME_FORMAT)))
+        rows.append((car_id, intervals))
+    return rows
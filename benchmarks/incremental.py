@@ -0,0 +1,95 @@
+import sys
+import time
+import random
+import argparse
+import pandas as pd
+from benchmarks.fleet import generate_fleet
+from benchmarks.run import same_match_results
+from src.match_snapshot import MatchSnapshot
+from src.data_extraction_and_processing.takamol import takamol_data_matcher
+from src.data_extraction_and_processing.docs_google import google_sheets_data_matcher
+
+SIZES = [1000, 10000]
+CHURN = 10
+MATCHERS = [
+    ('takamol', takamol_data_matcher, 'takamol', 'CarNo'),
+    ('google_sheets', google_sheets_data_matcher, 'sheet', 'Plate No'),
+]
+
+
+def change_fleet(yango_cars, source_data, source_column, churn, rng):
+    # churn изменений: номер авто меняется на номер другого, удаление, новое авто и правка номера в источнике
+    yango_cars, source_data = yango_cars.copy(), source_data.copy()
+    number = yango_cars.columns.get_loc('number')
+    for step in range(churn):
+        first, second = rng.sample(range(len(yango_cars)), 2)
+        yango_cars.iloc[first, number] = yango_cars.iloc[second, number]
+        added = yango_cars.iloc[[rng.randrange(len(yango_cars))]].assign(id=f'added-{step}')
+        yango_cars = pd.concat([yango_cars.drop(yango_cars.index[rng.randrange(len(yango_cars))]), added],
+                               ignore_index=True)
+        source_data.iloc[rng.randrange(len(source_data)), source_data.columns.get_loc(source_column)] = \
+            yango_cars.iloc[rng.randrange(len(yango_cars)), number]
+    return yango_cars, source_data
+
+
+def scenarios(yango_cars, source_data, source_column, churn, seed):
+    changed_yango, changed_source = change_fleet(yango_cars, source_data, source_column, churn, random.Random(seed))
+    duplicated = pd.concat([yango_cars, yango_cars.iloc[:3]], ignore_index=True)
+    missing_ids = yango_cars.assign(id=yango_cars['id'].where(yango_cars.index % 7 != 0))
+    return [
+        ('unchanged', yango_cars, source_data),
+        ('churn', changed_yango, changed_source),
+        # без уникальных id снимок не используется, мэтч полный
+        ('duplicate_ids', duplicated, source_data),
+        ('missing_ids', missing_ids, source_data),
+        ('empty_yango', yango_cars.iloc[:0], source_data),
+        ('after_empty', yango_cars, source_data),
+    ]
+
+
+def run_size(size, churn, seed):
+    fleet = generate_fleet(size, seed=seed)
+    results = []
+    for matcher, module, source, source_column in MATCHERS:
+        snapshot = MatchSnapshot('benchmark', matcher)
+        module.match_cars(fleet[source], fleet['yango_cars'], {}, snapshot)
+        for name, yango_cars, source_data in scenarios(fleet['yango_cars'], fleet[source], source_column,
+                                                       churn, seed):
+            started = time.perf_counter()
+            full = module.match_cars(source_data, yango_cars)
+            full_seconds = time.perf_counter() - started
+            stats = {}
+            started = time.perf_counter()
+            incremental = module.match_cars(source_data, yango_cars, stats, snapshot)
+            seconds = time.perf_counter() - started
+            result = {'benchmark': f'{matcher}:{name}', 'cars': size, 'seconds': seconds,
+                      'full_seconds': full_seconds, 'reused': stats['reused'], 'rows': len(source_data),
+                      'identical': same_match_results(incremental, full)}
+            results.append(result)
+            print_result(result)
+    return results
+
+
+def print_result(result):
+    identical = all(result['identical'].values())
+    print(f"{result['benchmark']:<32} {result['cars']:>7} cars {result['seconds']:>9.3f}s"
+          f" | full {result['full_seconds']:>9.3f}s reused {result['reused']:>7}/{result['rows']:<7}"
+          f" {'identical' if identical else 'DIFFERENT ' + str(result['identical'])}", flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Повторный мэтч по снимку прошлого запуска против полного мэтча")
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--churn', type=int, default=CHURN)
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args(argv)
+
+    results = []
+    for size in args.sizes:
+        results.extend(run_size(size, args.churn, args.seed))
+    different = [result for result in results if not all(result['identical'].values())]
+    return 1 if different else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
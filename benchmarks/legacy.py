@@ -0,0 +1,243 @@
+# Исходные реализации горячих функций (до оптимизаций), без логирования.
+# Нужны только как эталон для сравнения скорости и результатов, в пайплайне не используются.
+import re
+import json
+from datetime import datetime
+import pandas as pd
+import pytz
+
+TZ_DUBAI = pytz.timezone('Asia/Dubai')
+
+
+def normalize_string(s):
+    s = re.sub(r'\W+', '', str(s).lower())
+    replacements = {
+        'lamborgini': 'lamborghini', 'hurracan': 'huracan',
+        'rollsroyse': 'rollsroyce', 'bentaga': 'bentayga',
+        'hurcan': 'huracan', 'lambo': 'lamborghini',
+        'chevrolete': 'chevrolet', 'culinnan': 'cullinan',
+        'hundaisantafeh': 'hundaisantafe', 'posche': 'porsche',
+        'cayean': 'cayenne', 'landroverrangrov': 'landroverrangerover'
+    }
+    for old, new in replacements.items():
+        s = s.replace(old, new)
+    return s
+
+
+def convert_nan_to_none(data):
+    if isinstance(data, dict):
+        return {k: convert_nan_to_none(v) for k, v in data.items()}
+    elif isinstance(data, list):
+        return [convert_nan_to_none(item) for item in data]
+    elif pd.isna(data):
+        return None
+    else:
+        return data
+
+
+def extract_main_part_plate_no(plate_no):
+    match = re.search(r'[a-zA-Z]?(\d+)[a-zA-Z]?', plate_no)
+    if match:
+        return match.group(0)
+    return None
+
+
+def extract_number_part(plate_no):
+    match = re.search(r'\d+', plate_no)
+    if match:
+        return match.group(0)
+    return None
+
+
+def extract_letter_part(plate_no):
+    match = re.findall(r'[a-zA-Z]', plate_no)
+    if len(match) == 1:
+        return match[0]
+    elif len(match) == 2:
+        return match[-1]
+    else:
+        return None
+
+
+def extract_year_from_specifications(specs):
+    try:
+        specs_list = json.loads(specs.replace("'", '"'))
+        for spec in specs_list:
+            if spec.get('name') == 'Year' and 'value' in spec:
+                return int(spec['value'])
+    except json.JSONDecodeError:
+        return None
+    return None
+
+
+def takamol_match_cars(takamol_data, yango_cars_data):
+    def create_match_record(takamol_row, match_row):
+        return {
+            "ya_id": match_row['id'],
+            "ya_number": match_row['number'],
+            "ya_merge_manufacturer": match_row['merge_manufacturer'],
+            "ya_merge_short_name": match_row['merge_short_name'],
+            "takamol_CarNo": takamol_row['CarNo'],
+            "takamol_Model": takamol_row['Model'],
+            "takamol_MemberNo": takamol_row['MemberNo'],
+            "takamol_CarKey": takamol_row['CarKey'],
+            "takamol_CarName": takamol_row['CarName'],
+            "takamol_Reservations": takamol_row['Reservations']
+        }
+
+    matched = []
+    failed_takamol = []
+    failed_yango = yango_cars_data.copy()
+    multiple_matches = []
+
+    for _, takamol_row in takamol_data.iterrows():
+        car_no = normalize_string(takamol_row['CarNo'])
+        car_name = normalize_string(takamol_row['CarName'])
+        model_year = takamol_row['Model']
+        matches = yango_cars_data[
+            yango_cars_data['number'].apply(
+                lambda x: normalize_string(car_no) in normalize_string(x) or
+                          normalize_string(x) in normalize_string(car_no)) &
+            yango_cars_data['merge_manufacturer'].apply(
+                lambda x: normalize_string(x) in normalize_string(car_name))]
+        if len(matches) == 1:
+            matched.append(create_match_record(takamol_row, matches.iloc[0]))
+            failed_yango = failed_yango[failed_yango['number'] != matches.iloc[0]['number']]
+        elif len(matches) > 1:
+            if pd.notna(model_year) and re.match(r'^\d{4}$', str(model_year)):
+                model_year_matches = [match for _, match in matches.iterrows()
+                                      if extract_year_from_specifications(match.get('model_specifications_x'))
+                                      == model_year]
+                if len(model_year_matches) == 1:
+                    matched.append(create_match_record(takamol_row, model_year_matches[0]))
+                    failed_yango = failed_yango[failed_yango['number'] != model_year_matches[0]['number']]
+                    continue
+            multiple_matches.append({
+                "number": takamol_row['CarNo'],
+                "takamol_row": convert_nan_to_none(takamol_row.to_dict()),
+                "matches": convert_nan_to_none(matches.to_dict('records'))
+            })
+            failed_takamol.append(takamol_row)
+        else:
+            failed_takamol.append(takamol_row)
+
+    matched_df = pd.DataFrame(matched)
+    return matched_df, failed_takamol, failed_yango, multiple_matches
+
+
+def google_match_cars(sheet_data, yango_cars_data):
+    def create_match_record(sheet_row, match_row):
+        return {
+            "ya_id": match_row['id'],
+            "ya_number": match_row['number'],
+            "ya_merge_manufacturer": match_row['merge_manufacturer'],
+            "ya_merge_short_name": match_row['merge_short_name'],
+            "sheet_PlateNo": sheet_row['Plate No'],
+            "sheet_VehicleType": sheet_row['Vehicle Type'],
+            "sheet_Status": sheet_row['Status']
+        }
+
+    matched = []
+    failed_sheet = []
+    failed_yango = yango_cars_data.copy()
+    multiple_matches = []
+
+    for _, sheet_row in sheet_data.iterrows():
+        plate_no = normalize_string(sheet_row['Plate No'])
+        main_part_plate_no = extract_main_part_plate_no(plate_no)
+
+        if not main_part_plate_no:
+            failed_sheet.append(sheet_row)
+            continue
+
+        number_part = extract_number_part(main_part_plate_no)
+        letter_part = extract_letter_part(main_part_plate_no)
+        if not number_part or not letter_part:
+            failed_sheet.append(sheet_row)
+            continue
+
+        matches = yango_cars_data[
+            yango_cars_data['number'].apply(lambda x:
+                                            number_part in normalize_string(x) and
+                                            letter_part in normalize_string(x))]
+
+        if len(matches) == 1:
+            matched.append(create_match_record(sheet_row, matches.iloc[0]))
+            failed_yango = failed_yango[failed_yango['number'] != matches.iloc[0]['number']]
+        elif len(matches) > 1:
+            vehicle_type = normalize_string(sheet_row['Vehicle Type'])
+            manufacturer_matches = matches[
+                matches['merge_manufacturer'].apply(
+                    lambda x: normalize_string(x) in vehicle_type)
+            ]
+
+            if len(manufacturer_matches) == 1:
+                matched.append(create_match_record(sheet_row, manufacturer_matches.iloc[0]))
+                failed_yango = failed_yango[failed_yango['number'] != manufacturer_matches.iloc[0]['number']]
+            else:
+                multiple_matches.append({
+                    "plate_no": sheet_row['Plate No'],
+                    "sheet_row": convert_nan_to_none(sheet_row.to_dict()),
+                    "matches": convert_nan_to_none(matches.to_dict('records'))
+                })
+                failed_sheet.append(sheet_row)
+        else:
+            failed_sheet.append(sheet_row)
+
+    matched_df = pd.DataFrame(matched)
+    failed_sheet_df = pd.DataFrame(failed_sheet)
+    return matched_df, failed_sheet_df, failed_yango, multiple_matches
+
+
+def find_non_overlapping_intervals(new_intervals, existing_intervals):
+    result_intervals = []
+
+    for new_start, new_end, new_start_dubai, new_end_dubai in new_intervals:
+        current_intervals = [(new_start, new_end, new_start_dubai, new_end_dubai)]
+
+        for exist_start, exist_end in existing_intervals:
+            next_intervals = []
+            for interval in current_intervals:
+                interval_start, interval_end, interval_start_dubai, interval_end_dubai = interval
+                if interval_end <= exist_start or interval_start >= exist_end:
+                    next_intervals.append(interval)
+                else:
+                    if interval_start < exist_start:
+                        next_intervals.append((interval_start, exist_start, interval_start_dubai,
+                                    datetime.fromtimestamp(exist_start, TZ_DUBAI).strftime('%m/%d/%Y %I:%M:%S %p')))
+                    if interval_end > exist_end:
+                        next_intervals.append((exist_end, interval_end,
+                                    datetime.fromtimestamp(exist_end, TZ_DUBAI).strftime('%m/%d/%Y %I:%M:%S %p'),
+                                               interval_end_dubai))
+
+            current_intervals = next_intervals
+
+        result_intervals.extend(current_intervals)
+
+    return result_intervals
+
+
+def merge_overlapping_intervals(intervals):
+    if not intervals:
+        return []
+
+    sorted_intervals = sorted(intervals, key=lambda x: x[0])
+    merged_intervals = [sorted_intervals[0]]
+
+    for current in sorted_intervals[1:]:
+        last = merged_intervals[-1]
+        if current[0] <= last[1]:
+            merged_intervals[-1] = (last[0], max(last[1], current[1]), last[2], current[3])
+        else:
+            merged_intervals.append(current)
+    return merged_intervals
+
+
+def free_intervals(requested_rows, bookings_data):
+    # как в исходном merge_data: для каждой строки фильтр броней по id_car и попарное вычитание
+    result = []
+    for row, (ya_id, intervals) in enumerate(requested_rows):
+        existing_intervals = bookings_data[bookings_data['id_car'] == ya_id][['since', 'until']].values.tolist()
+        for interval in find_non_overlapping_intervals(merge_overlapping_intervals(intervals), existing_intervals):
+            result.append((row,) + tuple(interval))
+    return result
@@ -0,0 +1,129 @@
+import sys
+import json
+import time
+import argparse
+import tracemalloc
+import pandas as pd
+from benchmarks import legacy
+from benchmarks.fleet import generate_fleet, generate_requested_intervals
+from src.data_helper import PipelineContext, BookingsIndex, merge_overlapping_intervals, \
+    find_non_overlapping_intervals
+from src.model_catalog import model_catalog
+from src.data_extraction_and_processing.ya import ya_data_join
+from src.data_extraction_and_processing.takamol import takamol_data_matcher
+from src.data_extraction_and_processing.docs_google import google_sheets_data_matcher
+
+SIZES = [100, 1000, 10000, 100000]
+LEGACY_MAX_SIZE = 1000
+REQUESTED_COLUMNS = ['row', 'since', 'until', 'since_Dubai', 'until_Dubai']
+
+
+def free_intervals(requested_rows, bookings_data):
+    requested = pd.DataFrame([(row, *interval) for row, (_, intervals) in enumerate(requested_rows)
+                              for interval in intervals], columns=REQUESTED_COLUMNS)
+    merged = merge_overlapping_intervals(requested)
+    merged['ya_id'] = [requested_rows[row][0] for row in merged['row']]
+    return find_non_overlapping_intervals(merged, BookingsIndex(bookings_data))
+
+
+def join_yango_data(fleet):
+    model_catalog.update(fleet['models'], time.time())
+    context = PipelineContext('benchmark', context_logger, persist=False, load_from_disk=False)
+    context.put('yango_cars', fleet['raw_yango_cars'])
+    ya_data_join.merge_csv_files('benchmark', context)
+    return context.frames['merged_yango_data']
+
+
+def measure(func, *args, repeat=1):
+    # время - лучшее из repeat запусков, пиковая память - отдельным запуском под tracemalloc
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - started)
+    tracemalloc.start()
+    func(*args)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return result, best, peak
+
+
+def same_match_results(optimized, reference):
+    matched, failed, failed_yango, multiple_matches = optimized
+    legacy_matched, legacy_failed, legacy_failed_yango, legacy_multiple_matches = reference
+    # брони takamol теперь отдельной таблицей и в записи мэтча не попадают
+    legacy_matched = legacy_matched.drop(columns=['takamol_Reservations'], errors='ignore')
+    return {
+        'matched': matched.equals(legacy_matched),
+        'failed': pd.DataFrame(failed).equals(pd.DataFrame(legacy_failed)),
+        'failed_yango': failed_yango.equals(legacy_failed_yango),
+        'multiple_matches': multiple_matches == legacy_multiple_matches,
+    }
+
+
+def same_intervals(optimized, reference):
+    rows = [(int(row), int(since), int(until), since_dubai, until_dubai)
+            for row, since, until, since_dubai, until_dubai in optimized.itertuples(index=False)]
+    return {'intervals': rows == reference}
+
+
+def run_size(size, repeat, legacy_max_size, seed):
+    fleet = generate_fleet(size, seed=seed)
+    requested_rows = generate_requested_intervals(fleet, seed=seed)
+    benchmarks = [
+        ('takamol_match_cars', takamol_data_matcher.match_cars, legacy.takamol_match_cars,
+         (fleet['takamol'], fleet['yango_cars']), same_match_results),
+        ('google_match_cars', google_sheets_data_matcher.match_cars, legacy.google_match_cars,
+         (fleet['sheet'], fleet['yango_cars']), same_match_results),
+        ('find_non_overlapping_intervals', free_intervals, legacy.free_intervals,
+         (requested_rows, fleet['bookings']), same_intervals),
+        ('ya_data_join', join_yango_data, None, (fleet,), None),
+    ]
+    results = []
+    for name, optimized, reference, args, compare in benchmarks:
+        output, seconds, peak = measure(optimized, *args, repeat=repeat)
+        result = {'benchmark': name, 'cars': size, 'seconds': seconds, 'peak_mb': peak / 2 ** 20}
+        if reference and size <= legacy_max_size:
+            legacy_output, legacy_seconds, legacy_peak = measure(reference, *args)
+            result.update({'legacy_seconds': legacy_seconds, 'legacy_peak_mb': legacy_peak / 2 ** 20,
+                           'speedup': legacy_seconds / seconds if seconds else None,
+                           'identical': compare(output, legacy_output)})
+        results.append(result)
+        print_result(result)
+    return results
+
+
+def print_result(result):
+    line = f"{result['benchmark']:<32} {result['cars']:>7} cars {result['seconds']:>9.3f}s {result['peak_mb']:>8.1f} MB"
+    if 'legacy_seconds' in result:
+        identical = all(result['identical'].values())
+        line += (f" | legacy {result['legacy_seconds']:>9.3f}s {result['legacy_peak_mb']:>8.1f} MB"
+                 f" x{result['speedup']:.1f} {'identical' if identical else 'DIFFERENT ' + str(result['identical'])}")
+    print(line, flush=True)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Бенчмарки матчеров, вычитания интервалов и join каталога моделей")
+    parser.add_argument('--sizes', type=int, nargs='+', default=SIZES)
+    parser.add_argument('--repeat', type=int, default=3)
+    parser.add_argument('--legacy-max-size', type=int, default=LEGACY_MAX_SIZE,
+                        help="исходные реализации квадратичны, на больших парках их не запускаем")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help="путь для json с результатами")
+    args = parser.parse_args(argv)
+
+    results = []
+    for size in args.sizes:
+        results.extend(run_size(size, args.repeat, args.legacy_max_size, args.seed))
+    if args.output:
+        with open(args.output, mode='w', encoding='utf-8') as file:
+            json.dump(results, file, indent=4)
+    different = [result for result in results if 'identical' in result and not all(result['identical'].values())]
+    return 1 if different else 0
+
+
+context_logger = takamol_data_matcher.logger
+
+if __name__ == "__main__":
+    sys.exit(main())
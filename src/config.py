@@ -1,5 +1,6 @@
 import os
 import json
+import threading
 import pytz
 from datetime import datetime
 
@@ -18,7 +19,27 @@ def load_config(file_path):
         return json.load(f)
 
 
-_config_json = load_config(os.path.join(BASE_DIR, 'config.json'))
+CONFIG_FILE = os.path.join(BASE_DIR, 'config.json')
+
+_config = None
+_config_lock = threading.Lock()
+
+
+def get_config():
+    # config.json читается при первом обращении, а не при импорте модуля
+    global _config
+    if _config is None:
+        with _config_lock:
+            if _config is None:
+                _config = load_config(CONFIG_FILE)
+    return _config
+
+
+def __getattr__(name):
+    # совместимость со старым `from src.config import _config_json`
+    if name == '_config_json':
+        return get_config()
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 
 class GoogleSheetsConfig:
@@ -0,0 +1,133 @@
+import os
+import time
+import heapq
+import random
+import signal
+import threading
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+from src.settings import setup_logging
+from src.config import get_config
+from src.main import process_company, get_requests_per_company
+from src.metrics import MetricsRegistry
+from src.data_extraction_and_processing import del_old_data
+
+script_name = os.path.splitext(os.path.basename(__file__))[0]
+logger = setup_logging(script_name)
+
+DAEMON_CONFIG = {
+    "interval_minutes": 30,
+    "hot_interval_minutes": 10,
+    "hot_window_hours": 6,
+    "jitter_seconds": 60,
+    "max_workers": 4,
+    "cleanup_interval_minutes": 60,
+    "idle_sleep_seconds": 5
+}
+
+
+class CompanyScheduler:
+    # каждая компания обновляется по своему интервалу с джиттером; если бронь или холд начинается
+    # в пределах hot_window, компания считается горячей и обновляется чаще
+    def __init__(self, companies, daemon_config):
+        self.companies = companies
+        self.config = {**DAEMON_CONFIG, **daemon_config}
+        self.queue = []
+        now = time.time()
+        for company_name in companies:
+            heapq.heappush(self.queue, (now + random.uniform(0, self.config["jitter_seconds"]), company_name))
+
+    def get_interval(self, company_name, result):
+        company_config = self.companies[company_name]
+        interval = company_config.get("refresh_interval_minutes", self.config["interval_minutes"]) * 60
+        next_booking_since = (result or {}).get("next_booking_since")
+        if next_booking_since and next_booking_since - time.time() < self.config["hot_window_hours"] * 3600:
+            interval = min(interval, company_config.get("hot_refresh_interval_minutes",
+                                                        self.config["hot_interval_minutes"]) * 60)
+        return interval
+
+    def reschedule(self, company_name, result):
+        interval = self.get_interval(company_name, result)
+        jitter = random.uniform(-self.config["jitter_seconds"], self.config["jitter_seconds"])
+        next_run = time.time() + max(interval + jitter, 0)
+        heapq.heappush(self.queue, (next_run, company_name))
+        logger.info(f"<{company_name}> next run in {(next_run - time.time()) / 60:.1f} min")
+
+    def pop_due(self):
+        due = []
+        now = time.time()
+        while self.queue and self.queue[0][0] <= now:
+            due.append(heapq.heappop(self.queue)[1])
+        return due
+
+    def seconds_until_next(self):
+        return max(self.queue[0][0] - time.time(), 0) if self.queue else None
+
+
+def write_metrics(daemon_metrics):
+    try:
+        daemon_metrics.write()
+    except IOError as e:
+        logger.error(f"Failed to save metrics: {e}")
+
+
+def run(stop_event, companies=None, daemon_config=None):
+    from src.http_transport import configure_pool
+    companies = companies or get_config()['ya_companies']
+    scheduler = CompanyScheduler(companies, daemon_config or get_config().get("daemon", {}))
+    config = scheduler.config
+    next_cleanup = time.time() + config["cleanup_interval_minutes"] * 60
+    del_old_data.main()
+    logger.info(f"Daemon started for {len(companies)} companies")
+
+    running = {}
+    # метрики копятся за всё время работы демона, файлы перезаписываются после каждой компании
+    daemon_metrics = MetricsRegistry()
+    configure_pool(config["max_workers"] * get_requests_per_company(get_config()))
+    with ThreadPoolExecutor(max_workers=config["max_workers"]) as executor:
+        while not stop_event.is_set() or running:
+            if not stop_event.is_set():
+                for company_name in scheduler.pop_due():
+                    running[executor.submit(process_company, company_name, companies[company_name])] = company_name
+
+            if running:
+                timeout = scheduler.seconds_until_next()
+                timeout = config["idle_sleep_seconds"] if timeout is None else min(timeout,
+                                                                                    config["idle_sleep_seconds"])
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+                for future in done:
+                    company_name = running.pop(future)
+                    try:
+                        result = future.result()
+                    except Exception as e:
+                        logger.error(f"<{company_name}> Worker failed: {e}")
+                        result = None
+                    if result:
+                        daemon_metrics.merge(result.get('metrics'))
+                        write_metrics(daemon_metrics)
+                    if not stop_event.is_set():
+                        scheduler.reschedule(company_name, result)
+            else:
+                timeout = scheduler.seconds_until_next()
+                stop_event.wait(config["idle_sleep_seconds"] if timeout is None else timeout)
+
+            if not running and time.time() >= next_cleanup and not stop_event.is_set():
+                del_old_data.main()
+                next_cleanup = time.time() + config["cleanup_interval_minutes"] * 60
+
+    logger.info("Daemon stopped")
+
+
+def main():
+    stop_event = threading.Event()
+
+    def stop(signum, frame):
+        logger.info(f"Received signal {signum}, finishing running companies...")
+        stop_event.set()
+
+    signal.signal(signal.SIGTERM, stop)
+    signal.signal(signal.SIGINT, stop)
+    run(stop_event)
+
+
+if __name__ == "__main__":
+    main()
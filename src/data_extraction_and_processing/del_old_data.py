@@ -8,7 +8,7 @@ logger = setup_logging(script_name)
 
 DATA_PATH = os.path.join(BASE_DIR, 'data')
 LOGS_PATH = os.path.join(BASE_DIR, 'logs')
-FILE_EXTENSIONS = ['.csv', '.log', '.json']
+FILE_EXTENSIONS = ['.csv', '.parquet', '.arrow', '.log', '.json']
 TIME_THRESHOLD = timedelta(minutes=1)
 
 
@@ -1,13 +1,21 @@
 import os
+import time
+import threading
 import pandas as pd
 from oauth2client.service_account import ServiceAccountCredentials
 import gspread
 from src.config import GoogleSheetsConfig, get_current_datetime, BASE_DIR
 from src.settings import setup_logging
-from src.data_helper import CSVDataSaver
+from src.data_helper import PipelineContext
 
 GOOGLE_SHEETS_DIR = os.path.join(BASE_DIR, 'data/raw/docs_google')
-os.makedirs(GOOGLE_SHEETS_DIR, exist_ok=True)
+AUTH_TTL = 30 * 60
+
+script_name = os.path.splitext(os.path.basename(__file__))[0]
+logger = setup_logging(script_name)
+
+_authorized_clients = {}
+_authorized_clients_lock = threading.Lock()
 
 
 class GoogleSheetsClient:
@@ -18,9 +26,16 @@ class GoogleSheetsClient:
         self.client = self.authenticate()
 
     def authenticate(self):
-        scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
-        creds = ServiceAccountCredentials.from_json_keyfile_name(self.auth_config.credentials_file, scope)
-        return gspread.authorize(creds)
+        # авторизованный клиент переиспользуется в процессе, пока не истек AUTH_TTL
+        credentials_file = self.auth_config.credentials_file
+        with _authorized_clients_lock:
+            client, authorized_at = _authorized_clients.get(credentials_file, (None, 0.0))
+            if client is None or time.time() - authorized_at > AUTH_TTL:
+                scope = ["https://spreadsheets.google.com/feeds", "https://www.googleapis.com/auth/drive"]
+                creds = ServiceAccountCredentials.from_json_keyfile_name(credentials_file, scope)
+                client = gspread.authorize(creds)
+                _authorized_clients[credentials_file] = (client, time.time())
+            return client
 
     def get_data(self):
         try:
@@ -34,20 +49,18 @@ class GoogleSheetsClient:
             return None
 
 
-def main(company_name, sheet_config):
-    script_name = os.path.splitext(os.path.basename(__file__))[0]
-    logger = setup_logging(script_name)
+def main(company_name, sheet_config, context=None):
     logger.debug(f"<{company_name}> Script started.")
 
     auth_config = GoogleSheetsConfig()
     google_sheets_client = GoogleSheetsClient(auth_config, sheet_config, logger)
-    data_saver = CSVDataSaver(logger)
+    context = context or PipelineContext(company_name, logger)
 
     df = google_sheets_client.get_data()
     if df is not None:
         output_file = os.path.join(GOOGLE_SHEETS_DIR, company_name,
                                    f'{company_name}_data_{get_current_datetime()}.csv')
-        data_saver.save_dataframe_to_csv(df, output_file)
+        context.put('sheet_data', df, output_file)
     else:
         logger.error(f"<{company_name}> No data fetched from Google Sheets.")
 
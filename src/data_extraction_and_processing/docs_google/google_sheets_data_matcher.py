@@ -1,105 +1,222 @@
 import pandas as pd
 import os
-from src.settings import setup_logging
+import re
+from collections import defaultdict
+from src.settings import setup_logging, log_sampled
 from src.config import get_current_datetime, BASE_DIR
-from src.data_helper import LatestFileFetcher, CSVDataSaver, \
-    DataNormalizer, JSONDataSaver
+from src.metrics import record_matcher_results
+from src.data_helper import PipelineContext, DataNormalizer, JSONDataSaver
+from src.match_snapshot import MatchSnapshot, hash_rows, get_rows
 
 script_name = os.path.splitext(os.path.basename(__file__))[0]
 logger = setup_logging(script_name)
-file_fetcher = LatestFileFetcher(logger)
-data_saver = CSVDataSaver(logger)
 json_saver = JSONDataSaver(logger)
 
 YA_DIR = 'data/processing/yango_cars'
 GOOGLE_SHEETS_DIR = 'data/raw/docs_google'
+# до стольких строк полный проход дешевле построения индекса: по замерам benchmarks граница
+# ≈300 строк на парке в 2 тыс. авто и ≈550 на 20 тыс., берется нижняя
+SCAN_MAX_ROWS = 300
+# колонки, от которых зависит результат мэтча строки
+YANGO_KEY_COLUMNS = ['number', 'merge_manufacturer']
+SHEET_KEY_COLUMNS = ['Plate No', 'Vehicle Type']
+
+
+def load_data(company_name, context):
+    sheet_data = context.get('sheet_data', os.path.join(BASE_DIR, GOOGLE_SHEETS_DIR, company_name),
+                             '*_data*.csv')
+    yango_cars_data = context.get('merged_yango_data', os.path.join(BASE_DIR, YA_DIR, company_name),
+                                  '*merged_yango_data*.csv')
+    return sheet_data, yango_cars_data
 
 
-def load_data(company_name):
-    sheet_data = file_fetcher.get_and_load_latest_csv(os.path.join(BASE_DIR, GOOGLE_SHEETS_DIR,
-                                                                   company_name), '*_data*.csv')
-    yango_cars_data = file_fetcher.get_and_load_latest_csv(os.path.join(BASE_DIR, YA_DIR,
-                                                                        company_name), '*merged_yango_data*.csv')
-    return sheet_data, yango_cars_data
+def create_match_records(sheet_rows, matches):
+    # sheet_rows и matches - строки таблицы и авто ya, выровненные по позиции
+    if sheet_rows.empty:
+        return pd.DataFrame()
+    return pd.DataFrame({
+        "ya_id": matches['id'].to_numpy(),
+        "ya_number": matches['number'].to_numpy(),
+        "ya_merge_manufacturer": matches['merge_manufacturer'].to_numpy(),
+        "ya_merge_short_name": matches['merge_short_name'].to_numpy(),
+        "sheet_PlateNo": sheet_rows['Plate No'].to_numpy(),
+        "sheet_VehicleType": sheet_rows['Vehicle Type'].to_numpy(),
+        "sheet_Status": sheet_rows['Status'].to_numpy()
+    }).infer_objects()
+
 
+def normalize_yango(yango_cars_data):
+    # [номер, производитель] каждого авто ya
+    yango_plates = DataNormalizer.normalize_plates(yango_cars_data.get('number', []),
+                                                   yango_cars_data.get('merge_manufacturer', []))
+    return [list(key) for key in zip(yango_plates['plate'], yango_plates['manufacturer'])]
 
-def create_match_record(sheet_row, match_row):
-    try:
-        sheet_row['Vehicle Type']
-    except:
-        print(dict(sheet_row))
-    return {
-        "ya_id": match_row['id'],
-        "ya_number": match_row['number'],
-        "ya_merge_manufacturer": match_row['merge_manufacturer'],
-        "ya_merge_short_name": match_row['merge_short_name'],
-        "sheet_PlateNo": sheet_row['Plate No'],
-        "sheet_VehicleType": sheet_row['Vehicle Type'],
-        "sheet_Status": sheet_row['Status']
-    }
+
+def normalize_sheet(sheet_data):
+    # [основная часть, число, буква, тип авто] номера каждой строки таблицы
+    sheet_plates = DataNormalizer.normalize_plates(sheet_data.get('Plate No', []), sheet_data.get('Vehicle Type', []))
+    return [list(key) for key in zip(sheet_plates['main_part'], sheet_plates['number_part'],
+                                     sheet_plates['letter_part'], sheet_plates['manufacturer'])]
 
 
 def add_to_multiple_matches(multiple_matches, sheet_row, matches):
+    # matches - записи авто ya (to_dict('records'))
     multiple_matches.append({
         "plate_no": sheet_row['Plate No'],
         "sheet_row": DataNormalizer.convert_nan_to_none(sheet_row.to_dict()),
-        "matches": DataNormalizer.convert_nan_to_none(matches.to_dict('records'))
+        "matches": DataNormalizer.convert_nan_to_none(matches)
     })
 
 
-def match_cars(sheet_data, yango_cars_data):
-    matched = []
-    failed_sheet = []
-    failed_yango = yango_cars_data.copy()
-    multiple_matches = []
-
-    for _, sheet_row in sheet_data.iterrows():
-        plate_no = DataNormalizer.normalize_string(sheet_row['Plate No'])
-        main_part_plate_no = DataNormalizer.extract_main_part_plate_no(plate_no)
-
-        if not main_part_plate_no:
-            failed_sheet.append(sheet_row)
+def build_plate_index(normalized_numbers):
+    # (числовая подстрока, буква) -> позиции авто ya, эквивалентно проверке через "in" по номеру
+    plate_index = defaultdict(list)
+    for position, normalized_number in enumerate(normalized_numbers):
+        letters = set(re.findall(r'[a-z]', normalized_number))
+        keys = set()
+        for digits in re.findall(r'\d+', normalized_number):
+            for start in range(len(digits)):
+                for end in range(start + 1, len(digits) + 1):
+                    keys.update((digits[start:end], letter) for letter in letters)
+        for key in keys:
+            plate_index[key].append(position)
+    return plate_index
+
+
+class YangoPlatesIndex:
+    # нормализованные номера и производители ya; индекс (число, буква) строится при первом поиске -
+    # для нескольких строк хватает полного прохода (scan)
+    def __init__(self, yango_cars_data, yango_keys=None):
+        if yango_keys is None:
+            yango_keys = normalize_yango(yango_cars_data)
+        self.numbers = [number for number, _ in yango_keys]
+        self.manufacturers = [manufacturer for _, manufacturer in yango_keys]
+        self.plate_index = None
+        self.comparisons = 0
+
+    def candidates(self, number_part, letter_part):
+        if self.plate_index is None:
+            self.plate_index = build_plate_index(self.numbers)
+        positions = self.plate_index.get((number_part, letter_part), [])
+        self.comparisons += len(positions)
+        return positions
+
+    def scan(self, number_part, letter_part):
+        # то же условие, что и ключ build_plate_index
+        self.comparisons += len(self.numbers)
+        return [position for position, number in enumerate(self.numbers)
+                if number_part in number and letter_part in re.findall(r'[a-z]', number)]
+
+
+def match_row(yango_index, plate, scan=False):
+    # результат строки таблицы: ('matched', [позиция]), ('multiple', позиции) или ('failed', [])
+    main_part, number_part, letter_part, vehicle_type = plate
+    if pd.isna(main_part):
+        return 'failed', []
+    if pd.isna(letter_part):
+        logger.error(f"Invalid plate number format: {main_part}")
+        return 'failed', []
+
+    positions = yango_index.scan(number_part, letter_part) if scan else \
+        yango_index.candidates(number_part, letter_part)
+    if len(positions) == 1:
+        return 'matched', positions
+    if len(positions) > 1:
+        manufacturer_positions = [position for position in positions
+                                  if yango_index.manufacturers[position] in vehicle_type]
+        if len(manufacturer_positions) == 1:
+            return 'matched', manufacturer_positions
+        return 'multiple', positions
+    return 'failed', []
+
+
+def reuse_results(cached, sheet_keys, yango_ids, changed):
+    # результаты прошлого запуска для строк, которых не касаются изменения парка ya;
+    # строки без номера не переиспользуются - они не ищутся, а ошибка формата должна попасть в лог
+    results = [None] * len(cached)
+    # если изменилась большая часть парка, проверка строк дороже полного мэтча
+    if yango_ids is None or len(changed) > len(yango_ids) // 2:
+        return results
+    positions_by_id = {car_id: position for position, car_id in enumerate(yango_ids)}
+    changed_index = YangoPlatesIndex(None, changed)
+    affected = changed_index.scan if len(changed) <= SCAN_MAX_ROWS else changed_index.candidates
+    for row, result in enumerate(cached):
+        _, number_part, letter_part, _ = sheet_keys[row]
+        if result is None or pd.isna(letter_part) or \
+                any(car_id not in positions_by_id for car_id in result[1]) or \
+                (changed and affected(number_part, letter_part)):
             continue
+        results[row] = (result[0], sorted(positions_by_id[car_id] for car_id in result[1]))
+    return results
 
-        number_part = DataNormalizer.extract_number_part(main_part_plate_no)
-        letter_part = DataNormalizer.extract_letter_part(main_part_plate_no)
-        if not number_part or not letter_part:
-            failed_sheet.append(sheet_row)
-            logger.error(f"Invalid plate number format: {main_part_plate_no}")
-            continue
 
-        matches = yango_cars_data[
-            yango_cars_data['number'].apply(lambda x:
-                                            number_part in DataNormalizer.normalize_string(x) and
-                                            letter_part in DataNormalizer.normalize_string(x))]
-
-        if len(matches) == 1:
-            matched.append(create_match_record(sheet_row, matches.iloc[0]))
-            failed_yango = failed_yango[failed_yango['number'] != matches.iloc[0]['number']]
-        elif len(matches) > 1:
-            vehicle_type = DataNormalizer.normalize_string(sheet_row['Vehicle Type'])
-            manufacturer_matches = matches[
-                matches['merge_manufacturer'].apply(
-                    lambda x: DataNormalizer.normalize_string(x) in vehicle_type)
-            ]
-
-            if len(manufacturer_matches) == 1:
-                matched.append(create_match_record(sheet_row, manufacturer_matches.iloc[0]))
-                failed_yango = failed_yango[failed_yango['number'] != manufacturer_matches.iloc[0]['number']]
-            else:
-                add_to_multiple_matches(multiple_matches, sheet_row, matches)
-                failed_sheet.append(sheet_row)
-        else:
-            failed_sheet.append(sheet_row)
-
-    matched_df = pd.DataFrame(matched)
+def match_cars(sheet_data, yango_cars_data, stats=None, snapshot=None):
+    failed_sheet = []
+    multiple_matches = []
+    # с уникальными id авто ya нормализуются только строки, изменившиеся с прошлого запуска
+    yango_ids = MatchSnapshot.get_yango_ids(yango_cars_data) if snapshot is not None else None
+    if yango_ids is not None:
+        yango_hashes = hash_rows(yango_cars_data, YANGO_KEY_COLUMNS)
+        sheet_hashes = hash_rows(sheet_data, SHEET_KEY_COLUMNS)
+        yango_keys, changed = snapshot.sync_yango(yango_cars_data, yango_ids, yango_hashes, normalize_yango)
+        cached = [snapshot.get(sheet_hash) for sheet_hash in sheet_hashes]
+    else:
+        yango_keys, changed = normalize_yango(yango_cars_data), []
+        cached = [None] * len(sheet_data)
+    sheet_keys = [result[2:] if result is not None else None for result in cached]
+    stale = [row for row, result in enumerate(cached) if result is None]
+    for row, key in zip(stale, normalize_sheet(get_rows(sheet_data, stale))):
+        sheet_keys[row] = key
+
+    yango_index = YangoPlatesIndex(yango_cars_data, yango_keys)
+    results = reuse_results(cached, sheet_keys, yango_ids, changed)
+    pending = [row for row, result in enumerate(results) if result is None]
+    # строки без номера по парку не ищутся и на выбор полного прохода не влияют
+    scan = sum(pd.notna(sheet_keys[row][2]) for row in pending) <= SCAN_MAX_ROWS
+    for row in pending:
+        results[row] = match_row(yango_index, sheet_keys[row], scan)
+        log_sampled(logger, 'match_row', "Sheet plate %s: %s, %s candidates",
+                    sheet_keys[row][0], results[row][0], len(results[row][1]))
+
+    matched_rows = [row for row, (status, _) in enumerate(results) if status == 'matched']
+    matches = yango_cars_data.iloc[[results[row][1][0] for row in matched_rows]]
+    matched_df = create_match_records(get_rows(sheet_data, matched_rows), matches)
+    matched_numbers = set(matches['number']) if matched_rows else set()
+
+    failed_rows = [row for row, (status, _) in enumerate(results) if status != 'matched']
+    multiple_positions = sorted({position for status, positions in results if status == 'multiple'
+                                 for position in positions})
+    yango_records = dict(zip(multiple_positions, yango_cars_data.iloc[multiple_positions].to_dict('records')))
+    for row, (_, sheet_row) in zip(failed_rows, get_rows(sheet_data, failed_rows).iterrows()):
+        status, positions = results[row]
+        if status == 'multiple':
+            add_to_multiple_matches(multiple_matches, sheet_row, [yango_records[position] for position in positions])
+        failed_sheet.append(sheet_row)
+
+    if snapshot is not None and yango_ids is None:
+        snapshot.reset()
+    elif snapshot is not None:
+        snapshot.update(yango_ids, yango_hashes, yango_keys, sheet_hashes,
+                        [[status, [yango_ids[position] for position in positions], *key]
+                         for (status, positions), key in zip(results, sheet_keys)])
+    if stats is not None:
+        stats['comparisons'] = yango_index.comparisons
+        stats['reused'] = len(results) - len(pending)
     failed_sheet_df = pd.DataFrame(failed_sheet)
+    failed_yango = yango_cars_data[~yango_cars_data['number'].isin(matched_numbers)] \
+        if matched_numbers else yango_cars_data.copy()
     return matched_df, failed_sheet_df, failed_yango, multiple_matches
 
 
-def main(company_name):
-    sheet_data, yango_cars_data = load_data(company_name)
-    matched, failed_sheet, failed_yango, multiple_matches = match_cars(sheet_data, yango_cars_data)
+def main(company_name, context=None):
+    context = context or PipelineContext(company_name, logger)
+    sheet_data, yango_cars_data = load_data(company_name, context)
+    stats = {}
+    snapshot = MatchSnapshot.load(company_name, 'google_sheets')
+    matched, failed_sheet, failed_yango, multiple_matches = match_cars(sheet_data, yango_cars_data, stats, snapshot)
+    snapshot.save(context.persist)
+    record_matcher_results(company_name, 'google_sheets', len(matched), len(multiple_matches),
+                           len(failed_sheet) - len(multiple_matches), stats['comparisons'], stats['reused'])
 
     logger.info(f"<{company_name}> Total cars in Google Sheets: {len(sheet_data)}")
     logger.info(f"<{company_name}> Total cars in YA: {len(yango_cars_data)}")
@@ -107,20 +224,21 @@ def main(company_name):
     logger.info(f"<{company_name}> Multiple matches cars: {len(multiple_matches)}")
     logger.info(f"<{company_name}> Unsuccessfully matched cars from Google Sheets: {len(failed_sheet)}")
     logger.info(f"<{company_name}> Unsuccessfully matched cars from YA: {len(failed_yango)}")
+    logger.info(f"<{company_name}> Results reused from previous run: {stats['reused']}")
 
     full_yango_dir = os.path.join(BASE_DIR, YA_DIR, company_name)
 
     if not matched.empty:
-        data_saver.save_dataframe_to_csv(matched, os.path.join(full_yango_dir,
-                                                    f"{company_name}_matched_{get_current_datetime()}.csv"))
+        context.put('matched', matched, os.path.join(full_yango_dir,
+                                                     f"{company_name}_matched_{get_current_datetime()}.csv"))
 
     if not failed_sheet.empty:
-        data_saver.save_dataframe_to_csv(failed_sheet, os.path.join(full_yango_dir,
+        context.put('unmatched_sheet', failed_sheet, os.path.join(full_yango_dir,
                                                     f"{company_name}_unmatched_sheet_{get_current_datetime()}.csv"))
     if not failed_yango.empty:
-        data_saver.save_dataframe_to_csv(failed_yango, os.path.join(full_yango_dir,
+        context.put('failed_yango', failed_yango, os.path.join(full_yango_dir,
                                                     f"{company_name}_failed_yango_{get_current_datetime()}.csv"))
-    if multiple_matches:
+    if multiple_matches and context.persist:
         json_saver.save_to_json(multiple_matches, os.path.join(full_yango_dir,
                                                     f'{company_name}_multiple_matches_{get_current_datetime()}.json'))
 
@@ -1,19 +1,16 @@
 import os
+import numpy as np
 import pandas as pd
 from datetime import datetime, timedelta
 from src.settings import setup_logging
 from src.config import get_current_datetime, BASE_DIR
-from src.data_helper import LatestFileFetcher, CSVDataSaver, JSONDataSaver, TZ_DUBAI, \
-    find_non_overlapping_intervals, merge_matched_and_ya_unmatched_data
+from src.data_helper import PipelineContext, BookingsIndex, TZ_DUBAI, \
+    find_non_overlapping_intervals, expand_rows_with_intervals, merge_matched_and_ya_unmatched_data
 
 script_name = os.path.splitext(os.path.basename(__file__))[0]
 logger = setup_logging(script_name)
-file_fetcher = LatestFileFetcher(logger)
-data_saver = CSVDataSaver(logger)
-json_saver = JSONDataSaver(logger)
 
 RES_DIR = os.path.join(BASE_DIR, 'data/final/')
-os.makedirs(RES_DIR, exist_ok=True)
 
 
 def get_intervals_for_default_booking():
@@ -25,72 +22,66 @@ def get_intervals_for_default_booking():
     return [(since, until, since_dubai, until_dubai)]
 
 
-def merge_data(bookings_data, matched_data):
+def merge_data(bookings_index, matched_data):
     logger.debug("Starting merge_data")
     logger.debug(f"Initial matched_data columns: {matched_data.columns}")
 
+    matched_data = matched_data.copy()
     matched_data['sheet_Status'] = matched_data['sheet_Status'].str.lower().str.replace(' ', '')
     filtered_matched_data = matched_data[matched_data['sheet_Status'] != 'available']
-    logger.debug(f"Filtered matched_data: {filtered_matched_data.head()}")
+    logger.debug(f"Filtered matched_data: {len(filtered_matched_data)} rows to hold")
 
-    results = []
     current_time = datetime.now(TZ_DUBAI).timestamp()
 
-    for index, row in filtered_matched_data.iterrows():
-        logger.debug(f"Processing row: {row}")
-        new_intervals = get_intervals_for_default_booking()
-        existing_intervals = bookings_data[bookings_data['id_car'] == row['ya_id']][['since', 'until']].values.tolist()
-        logger.debug(f"Existing intervals: {existing_intervals}")
-        non_overlapping_intervals = find_non_overlapping_intervals(new_intervals, existing_intervals, row['ya_id'],
-                                                                   logger)
-        logger.debug(f"Non-overlapping intervals: {non_overlapping_intervals}")
-        for interval in non_overlapping_intervals:
-            if interval[1] > current_time:
-                new_row = row.copy()
-                new_row['current_since'] = interval[0]
-                new_row['current_until'] = interval[1]
-                new_row['current_since_Dubai'] = interval[2]
-                new_row['current_until_Dubai'] = interval[3]
-                results.append(new_row)
-                logger.debug(f"Appended new_row: {new_row}")
-
-    merged_data = pd.DataFrame(results)
-    logger.debug(f"Final merged_data: {merged_data.head()}")
-
-    logger.debug("Finished merge_data")
+    (since, until, since_dubai, until_dubai), = get_intervals_for_default_booking()
+    new_intervals = pd.DataFrame({
+        'row': np.arange(len(filtered_matched_data)),
+        'ya_id': filtered_matched_data['ya_id'].to_numpy(),
+        'since': since,
+        'until': until,
+        'since_Dubai': since_dubai,
+        'until_Dubai': until_dubai,
+    })
+    non_overlapping_intervals = find_non_overlapping_intervals(new_intervals, bookings_index)
+    non_overlapping_intervals = non_overlapping_intervals[non_overlapping_intervals['current_until'] > current_time]
+
+    merged_data = expand_rows_with_intervals(filtered_matched_data, non_overlapping_intervals)
+    logger.debug(f"Finished merge_data: {len(merged_data)} intervals to hold")
     return merged_data
 
 
-def save_available_cars_with_bookings(bookings_data, matched_data, company_name):
+def save_available_cars_with_bookings(bookings_index, matched_data, company_name, context):
     available_cars = matched_data[matched_data['sheet_Status'].str.lower().str.replace(' ', '') == 'available']
-    cars_with_bookings = available_cars[available_cars['ya_id'].isin(bookings_data['id_car'])]
+    cars_with_bookings = available_cars[available_cars['ya_id'].isin(bookings_index.cars_with_bookings())]
 
     if not cars_with_bookings.empty:
         output_file = os.path.join(RES_DIR, company_name, f"available_cars_with_bookings_{get_current_datetime()}.csv")
-        data_saver.save_dataframe_to_csv(cars_with_bookings, output_file)
+        context.put('available_cars_with_bookings', cars_with_bookings, output_file)
         logger.info(f"<{company_name}> available cars with bookings: {len(cars_with_bookings)}")
     else:
         logger.debug(f"<{company_name}> No available cars with bookings found.")
 
 
-def save_prepare_data_for_loading(bookings_data, matched_data, ya_unmatched_data, company_name):
+def save_prepare_data_for_loading(bookings_index, matched_data, ya_unmatched_data, company_name, context):
     data_for_hold = merge_matched_and_ya_unmatched_data(matched_data, ya_unmatched_data)
     if data_for_hold.empty:
         logger.info(f"<{company_name}> No data to hold for unmatched cars.")
         return
 
-    merged_data = merge_data(bookings_data, data_for_hold)
+    merged_data = merge_data(bookings_index, data_for_hold)
     output_file = os.path.join(RES_DIR, company_name, f"ready_to_load_{get_current_datetime()}.csv")
-    data_saver.save_dataframe_to_csv(merged_data, output_file)
+    context.put('ready_to_load', merged_data, output_file)
     logger.info(f"<{company_name}> prepare_for_loading cars: {len(merged_data)}")
 
 
-def main(company_name):
-    bookings_data, matched_data, ya_unmatched_data = file_fetcher.load_data_for_preparing_for_load_script(company_name)
+def main(company_name, context=None):
+    context = context or PipelineContext(company_name, logger)
+    bookings_data, matched_data, ya_unmatched_data = context.load_data_for_preparing_for_load_script()
+    bookings_index = BookingsIndex(bookings_data)
 
-    save_available_cars_with_bookings(bookings_data, matched_data, company_name)
+    save_available_cars_with_bookings(bookings_index, matched_data, company_name, context)
 
-    save_prepare_data_for_loading(bookings_data, matched_data, ya_unmatched_data, company_name)
+    save_prepare_data_for_loading(bookings_index, matched_data, ya_unmatched_data, company_name, context)
 
 
 if __name__ == "__main__":
@@ -2,32 +2,38 @@ import json
 import pandas as pd
 import os
 import re
-from src.settings import setup_logging
+from collections import defaultdict
+from src.settings import setup_logging, log_sampled
 from src.config import get_current_datetime, BASE_DIR
-from src.data_helper import LatestFileFetcher,\
-    CSVDataSaver, DataNormalizer, JSONDataSaver
+from src.metrics import record_matcher_results
+from src.data_helper import PipelineContext, DataNormalizer, JSONDataSaver
+from src.match_snapshot import MatchSnapshot, hash_rows, get_rows
 
 script_name = os.path.splitext(os.path.basename(__file__))[0]
 logger = setup_logging(script_name)
-file_fetcher = LatestFileFetcher(logger)
-data_saver = CSVDataSaver(logger)
 json_saver = JSONDataSaver(logger)
 
 YA_DIR = 'data/processing/yango_cars'
 TAKAMOL_DIR = 'data/processing/takamol'
+# до стольких строк полный проход дешевле построения индекса подстрок: по замерам benchmarks граница
+# ≈100 строк на парке в 2 тыс. авто и ≈150 на 20 тыс., берется нижняя
+SCAN_MAX_ROWS = 100
+# колонки, от которых зависит результат мэтча строки
+YANGO_KEY_COLUMNS = ['number', 'merge_manufacturer', 'model_specifications_x']
+TAKAMOL_KEY_COLUMNS = ['CarNo', 'CarName', 'Model']
 
 
-def load_data(company_name):
-    takamol_data = file_fetcher.get_and_load_latest_csv(os.path.join(BASE_DIR, TAKAMOL_DIR,
-                                                                    company_name), '*takamol_unique_cars*.csv')
-    yango_cars_data = file_fetcher.get_and_load_latest_csv(os.path.join(BASE_DIR, YA_DIR,
-                                                                    company_name), '*merged_yango_data*.csv')
+def load_data(company_name, context):
+    takamol_data = context.get('takamol_unique_cars', os.path.join(BASE_DIR, TAKAMOL_DIR, company_name),
+                               '*takamol_unique_cars*.csv')
+    yango_cars_data = context.get('merged_yango_data', os.path.join(BASE_DIR, YA_DIR, company_name),
+                                  '*merged_yango_data*.csv')
     return takamol_data, yango_cars_data
 
 
 def extract_year_from_specifications(specs):
     try:
-        specs_list = json.loads(specs.replace("'", '"'))
+        specs_list = specs if isinstance(specs, list) else json.loads(specs.replace("'", '"'))
         for spec in specs_list:
             if spec.get('name') == 'Year' and 'value' in spec:
                 return int(spec['value'])
@@ -37,67 +43,197 @@ def extract_year_from_specifications(specs):
 
 
 def add_to_multiple_matches(multiple_matches, takamol_row, matches):
+    # matches - записи авто ya (to_dict('records'))
     multiple_matches.append({
         "number": takamol_row['CarNo'],
         "takamol_row": DataNormalizer.convert_nan_to_none(takamol_row.to_dict()),
-        "matches": DataNormalizer.convert_nan_to_none(matches.to_dict('records'))
+        "matches": DataNormalizer.convert_nan_to_none(matches)
     })
 
 
-def create_match_record(takamol_row, match_row):
-    return {
-        "ya_id": match_row['id'],
-        "ya_number": match_row['number'],
-        "ya_merge_manufacturer": match_row['merge_manufacturer'],
-        "ya_merge_short_name": match_row['merge_short_name'],
-        "takamol_CarNo": takamol_row['CarNo'],
-        "takamol_Model": takamol_row['Model'],
-        "takamol_MemberNo": takamol_row['MemberNo'],
-        "takamol_CarKey": takamol_row['CarKey'],
-        "takamol_CarName": takamol_row['CarName'],
-        "takamol_Reservations": takamol_row['Reservations']
-    }
+def create_match_records(takamol_rows, matches):
+    # takamol_rows и matches - строки takamol и авто ya, выровненные по позиции
+    if takamol_rows.empty:
+        return pd.DataFrame()
+    return pd.DataFrame({
+        "ya_id": matches['id'].to_numpy(),
+        "ya_number": matches['number'].to_numpy(),
+        "ya_merge_manufacturer": matches['merge_manufacturer'].to_numpy(),
+        "ya_merge_short_name": matches['merge_short_name'].to_numpy(),
+        "takamol_CarNo": takamol_rows['CarNo'].to_numpy(),
+        "takamol_Model": takamol_rows['Model'].to_numpy(),
+        "takamol_MemberNo": takamol_rows['MemberNo'].to_numpy(),
+        "takamol_CarKey": takamol_rows['CarKey'].to_numpy(),
+        "takamol_CarName": takamol_rows['CarName'].to_numpy()
+    }).infer_objects()
 
 
-def match_cars(takamol_data, yango_cars_data):
-    matched = []
+def normalize_yango(yango_cars_data):
+    # [номер, производитель] каждого авто ya
+    yango_plates = DataNormalizer.normalize_plates(yango_cars_data.get('number', []),
+                                                   yango_cars_data.get('merge_manufacturer', []))
+    return [list(key) for key in zip(yango_plates['plate'], yango_plates['manufacturer'])]
+
+
+def normalize_takamol(takamol_data):
+    # [номер, название] каждой строки takamol;
+    # повторная нормализация сохранена: normalize_string не идемпотентна (lambo -> lamborghini)
+    car_numbers = DataNormalizer.normalize_series(DataNormalizer.normalize_series(takamol_data.get('CarNo', [])))
+    car_names = DataNormalizer.normalize_series(DataNormalizer.normalize_series(takamol_data.get('CarName', [])))
+    return [list(key) for key in zip(car_numbers, car_names)]
+
+
+def substrings(s):
+    return {s[start:end] for start in range(len(s)) for end in range(start + 1, len(s) + 1)}
+
+
+class YangoCarsIndex:
+    # нормализованные номера и производители ya, кандидаты ищутся по подстрокам номера;
+    # индекс строится при первом поиске - для нескольких строк хватает полного прохода (scan)
+    def __init__(self, yango_cars_data, yango_keys=None):
+        self.yango_cars_data = yango_cars_data
+        if yango_keys is None:
+            yango_keys = normalize_yango(yango_cars_data)
+        self.numbers = [number for number, _ in yango_keys]
+        self.manufacturers = [manufacturer for _, manufacturer in yango_keys]
+        self.by_number = None
+        self.by_number_substring = None
+        self.model_years = {}
+        self.comparisons = 0
+
+    def build(self):
+        self.by_number = defaultdict(list)
+        self.by_number_substring = defaultdict(list)
+        for position, number in enumerate(self.numbers):
+            self.by_number[number].append(position)
+            for part in substrings(number):
+                self.by_number_substring[part].append(position)
+
+    def candidates(self, car_no, car_name):
+        if self.by_number is None:
+            self.build()
+        if not car_no:
+            positions = set(range(len(self.numbers)))
+        else:
+            positions = set(self.by_number_substring.get(car_no, []))
+            positions.update(self.by_number.get('', []))
+        for part in substrings(car_no):
+            positions.update(self.by_number.get(part, []))
+        self.comparisons += len(positions)
+        return [position for position in sorted(positions) if self.manufacturers[position] in car_name]
+
+    def scan(self, car_no, car_name):
+        # то же условие, что и candidates, проверкой каждого авто
+        self.comparisons += len(self.numbers)
+        return [position for position, (number, manufacturer) in enumerate(zip(self.numbers, self.manufacturers))
+                if (car_no in number or number in car_no) and manufacturer in car_name]
+
+    def model_year(self, position):
+        if position not in self.model_years:
+            specs = self.yango_cars_data.iloc[position].get('model_specifications_x')
+            self.model_years[position] = extract_year_from_specifications(specs)
+        return self.model_years[position]
+
+
+def match_row(yango_index, model_year, car_no, car_name, scan=False):
+    # результат строки takamol: ('matched', [позиция]), ('multiple', позиции) или ('failed', [])
+    positions = yango_index.scan(car_no, car_name) if scan else yango_index.candidates(car_no, car_name)
+    if len(positions) == 1:
+        return 'matched', positions
+    if len(positions) > 1:
+        if pd.notna(model_year) and re.match(r'^\d{4}$', str(model_year)):
+            model_year_positions = [position for position in positions
+                                    if yango_index.model_year(position) == int(model_year)]
+            if len(model_year_positions) == 1:
+                return 'matched', model_year_positions
+        return 'multiple', positions
+    return 'failed', []
+
+
+def reuse_results(cached, takamol_keys, yango_ids, changed):
+    # результаты прошлого запуска для строк, которых не касаются изменения парка ya
+    results = [None] * len(cached)
+    # если изменилась большая часть парка, проверка строк дороже полного мэтча
+    if yango_ids is None or len(changed) > len(yango_ids) // 2:
+        return results
+    positions_by_id = {car_id: position for position, car_id in enumerate(yango_ids)}
+    changed_index = YangoCarsIndex(None, changed)
+    affected = changed_index.scan if len(changed) <= SCAN_MAX_ROWS else changed_index.candidates
+    for row, result in enumerate(cached):
+        if result is None or any(car_id not in positions_by_id for car_id in result[1]) or \
+                (changed and affected(*takamol_keys[row])):
+            continue
+        results[row] = (result[0], sorted(positions_by_id[car_id] for car_id in result[1]))
+    return results
+
+
+def match_cars(takamol_data, yango_cars_data, stats=None, snapshot=None):
     failed_takamol = []
-    failed_yango = yango_cars_data.copy()
     multiple_matches = []
+    # с уникальными id авто ya нормализуются только строки, изменившиеся с прошлого запуска
+    yango_ids = MatchSnapshot.get_yango_ids(yango_cars_data) if snapshot is not None else None
+    if yango_ids is not None:
+        yango_hashes = hash_rows(yango_cars_data, YANGO_KEY_COLUMNS)
+        takamol_hashes = hash_rows(takamol_data, TAKAMOL_KEY_COLUMNS)
+        yango_keys, changed = snapshot.sync_yango(yango_cars_data, yango_ids, yango_hashes, normalize_yango)
+        cached = [snapshot.get(takamol_hash) for takamol_hash in takamol_hashes]
+    else:
+        yango_keys, changed = normalize_yango(yango_cars_data), []
+        cached = [None] * len(takamol_data)
+    takamol_keys = [result[2:] if result is not None else None for result in cached]
+    stale = [row for row, result in enumerate(cached) if result is None]
+    for row, key in zip(stale, normalize_takamol(get_rows(takamol_data, stale))):
+        takamol_keys[row] = key
 
-    for _, takamol_row in takamol_data.iterrows():
-        car_no = DataNormalizer.normalize_string(takamol_row['CarNo'])
-        car_name = DataNormalizer.normalize_string(takamol_row['CarName'])
-        model_year = takamol_row['Model']
-        matches = yango_cars_data[
-            yango_cars_data['number'].apply(
-                lambda x: DataNormalizer.normalize_string(car_no) in DataNormalizer.normalize_string(x) or
-                          DataNormalizer.normalize_string(x) in DataNormalizer.normalize_string(car_no)) &
-            yango_cars_data['merge_manufacturer'].apply(
-                lambda x: DataNormalizer.normalize_string(x) in DataNormalizer.normalize_string(car_name))]
-        if len(matches) == 1:
-            matched.append(create_match_record(takamol_row, matches.iloc[0]))
-            failed_yango = failed_yango[failed_yango['number'] != matches.iloc[0]['number']]
-        elif len(matches) > 1:
-            if pd.notna(model_year) and re.match(r'^\d{4}$', str(model_year)):
-                model_year_matches = [match for _, match in matches.iterrows()
-                            if extract_year_from_specifications(match.get('model_specifications_x')) == model_year]
-                if len(model_year_matches) == 1:
-                    matched.append(create_match_record(takamol_row, model_year_matches[0]))
-                    failed_yango = failed_yango[failed_yango['number'] != model_year_matches[0]['number']]
-                    continue
-            add_to_multiple_matches(multiple_matches, takamol_row, matches)
-            failed_takamol.append(takamol_row)
-        else:
-            failed_takamol.append(takamol_row)
+    yango_index = YangoCarsIndex(yango_cars_data, yango_keys)
+    results = reuse_results(cached, takamol_keys, yango_ids, changed)
+    pending = [row for row, result in enumerate(results) if result is None]
+    scan = len(pending) <= SCAN_MAX_ROWS
+    model_years = takamol_data.get('Model', pd.Series([None] * len(takamol_data))).tolist()
+    for row in pending:
+        results[row] = match_row(yango_index, model_years[row], *takamol_keys[row], scan)
+        log_sampled(logger, 'match_row', "Takamol car %s %s: %s, %s candidates",
+                    *takamol_keys[row], results[row][0], len(results[row][1]))
+
+    matched_rows = [row for row, (status, _) in enumerate(results) if status == 'matched']
+    matches = yango_cars_data.iloc[[results[row][1][0] for row in matched_rows]]
+    matched_df = create_match_records(get_rows(takamol_data, matched_rows), matches)
+    matched_numbers = set(matches['number']) if matched_rows else set()
+
+    failed_rows = [row for row, (status, _) in enumerate(results) if status != 'matched']
+    multiple_positions = sorted({position for status, positions in results if status == 'multiple'
+                                 for position in positions})
+    yango_records = dict(zip(multiple_positions, yango_cars_data.iloc[multiple_positions].to_dict('records')))
+    for row, (_, takamol_row) in zip(failed_rows, get_rows(takamol_data, failed_rows).iterrows()):
+        status, positions = results[row]
+        if status == 'multiple':
+            add_to_multiple_matches(multiple_matches, takamol_row, [yango_records[position] for position in positions])
+        failed_takamol.append(takamol_row)
 
-    matched_df = pd.DataFrame(matched)
+    if snapshot is not None and yango_ids is None:
+        snapshot.reset()
+    elif snapshot is not None:
+        snapshot.update(yango_ids, yango_hashes, yango_keys, takamol_hashes,
+                        [[status, [yango_ids[position] for position in positions], *key]
+                         for (status, positions), key in zip(results, takamol_keys)])
+    if stats is not None:
+        stats['comparisons'] = yango_index.comparisons
+        stats['reused'] = len(results) - len(pending)
+    failed_yango = yango_cars_data[~yango_cars_data['number'].isin(matched_numbers)] \
+        if matched_numbers else yango_cars_data.copy()
     return matched_df, failed_takamol, failed_yango, multiple_matches
 
 
-def main(company_name):
-    takamol_data, yango_cars_data = load_data(company_name)
-    matched, failed_takamol, failed_yango, multiple_matches = match_cars(takamol_data, yango_cars_data)
+def main(company_name, context=None):
+    context = context or PipelineContext(company_name, logger)
+    takamol_data, yango_cars_data = load_data(company_name, context)
+    stats = {}
+    snapshot = MatchSnapshot.load(company_name, 'takamol')
+    matched, failed_takamol, failed_yango, multiple_matches = match_cars(takamol_data, yango_cars_data, stats,
+                                                                         snapshot)
+    snapshot.save(context.persist)
+    record_matcher_results(company_name, 'takamol', len(matched), len(multiple_matches),
+                           len(failed_takamol) - len(multiple_matches), stats['comparisons'], stats['reused'])
 
     logger.info(f"<{company_name}> Total cars in Takamol: {len(takamol_data)}")
     logger.info(f"<{company_name}> Total cars in YA: {len(yango_cars_data)}")
@@ -105,13 +241,14 @@ def main(company_name):
     logger.info(f"<{company_name}> Multiple matches cars: {len(multiple_matches)}")
     logger.info(f"<{company_name}> Unsuccessfully matched cars from Takamol: {len(failed_takamol)}")
     logger.info(f"<{company_name}> Unsuccessfully matched cars from YA: {len(failed_yango)}")
+    logger.info(f"<{company_name}> Results reused from previous run: {stats['reused']}")
 
     full_yango_dir = os.path.join(BASE_DIR, YA_DIR, company_name)
 
     if not matched.empty:
-        data_saver.save_dataframe_to_csv(matched, os.path.join(full_yango_dir,
-                                        f"{company_name}_matched_{get_current_datetime()}.csv"))
-    if multiple_matches:
+        context.put('matched', matched, os.path.join(full_yango_dir,
+                                                     f"{company_name}_matched_{get_current_datetime()}.csv"))
+    if multiple_matches and context.persist:
         json_saver.save_to_json(multiple_matches, os.path.join(full_yango_dir,
                                         f'{company_name}_multiple_matches_{get_current_datetime()}.json'))
 
@@ -1,14 +1,19 @@
 import os
+import time
 import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
-from src.settings import setup_logging
+import pandas as pd
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from src.settings import setup_logging, log_sampled
 from src.config import get_current_datetime, BASE_DIR
-from src.data_helper import CSVDataSaver
+from src.data_helper import PipelineContext, DUBAI_DATETIME_FORMAT, parse_local_datetimes
+from src.http_transport import create_session
 
 API_BASE_URL = "http://www.takamol.com/api/TakamolMobileApi/CarsOnlineBooking_API"
+MAX_WORKERS = 4
+CAR_COLUMNS = ['CarKey', 'CarNo', 'CarName', 'Model', 'MemberNo']
+RESERVATION_COLUMNS = ['CarKey', 'since', 'until', 'since_Dubai', 'until_Dubai']
 DATA_DIR = os.path.join(BASE_DIR, 'data/raw/takamol')
-os.makedirs(DATA_DIR, exist_ok=True)
 
 script_name = os.path.splitext(os.path.basename(__file__))[0]
 logger = setup_logging(script_name)
@@ -16,23 +21,19 @@ logger = setup_logging(script_name)
 
 class TakamolAPIClient:
     def __init__(self, takamol_api_key, takamol_member_no):
-        self.session = self.create_session()
         self.takamol_api_key = takamol_api_key
         self.takamol_member_no = takamol_member_no
-        self.session.headers.update({'Authorization': f'Bearer {self.takamol_api_key}'})
+        self.session = self.create_session(self.takamol_api_key)
 
     @staticmethod
-    def create_session() -> requests.Session:
-        retries = Retry(total=5, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
-        session = requests.Session()
-        session.mount('http://', HTTPAdapter(max_retries=retries))
-        return session
+    def create_session(takamol_api_key) -> requests.Session:
+        return create_session({'Authorization': f'Bearer {takamol_api_key}'})
 
     def fetch_data(self, page_number: int, page_size: int):
         params = self.get_api_params(page_number, page_size)
         try:
             response = self.session.get(API_BASE_URL, params=params)
-            logger.debug(f"Request URL: {response.url}, Status Code: {response.status_code}")
+            logger.debug("Request URL: %s, Status Code: %s", response.url, response.status_code)
             response.raise_for_status()
             return response.json()
         except requests.exceptions.RequestException as e:
@@ -61,59 +62,103 @@ class TakamolAPIClient:
 
 
 class DataProcessor:
-    def __init__(self, company_name):
+    # авто и их брони пишутся в разные таблицы: брони - по строке на бронь с ключом CarKey
+    def __init__(self, company_name, sink, reservations_sink):
         self.company_name = company_name
-        self.all_cars = []
+        self.sink = sink
+        self.reservations_sink = reservations_sink
 
     def parse_data(self, json_data):
         if not json_data:
             return []
 
-        cars = []
-        for car in json_data:
-            car_data = car.copy()
-            reservations = car_data.pop('Reservations', [])
-            car_data.update({'Reservations': reservations})
-            cars.append(car_data)
+        return [{key: value for key, value in car.items() if key != 'Reservations'} for car in json_data]
 
-        return cars
-
-
-def fetch_all_data(client: TakamolAPIClient, processor: DataProcessor, page_size: int = 100) -> None:
-    page_number = 1
+    def parse_reservations(self, json_data):
+        reservations = pd.DataFrame([(car.get('CarKey'), reservation.get('FromDateTime'), reservation.get('ToDateTime'))
+                                     for car in json_data or [] for reservation in car.get('Reservations') or []],
+                                    columns=['CarKey', 'FromDateTime', 'ToDateTime'])
+        if reservations.empty:
+            return []
+        # даты всей страницы разбираются разом
+        since_parsed, since = parse_local_datetimes(reservations['FromDateTime'])
+        until_parsed, until = parse_local_datetimes(reservations['ToDateTime'])
+        invalid = (since.isna() | until.isna()).to_numpy()
+        if invalid.any():
+            logger.error(f"<{self.company_name}> Ошибка преобразования даты для {invalid.sum()} броней: "
+                         f"{reservations[invalid].head().to_dict('records')}")
+        records = pd.DataFrame({
+            'CarKey': reservations['CarKey'],
+            'since': since,
+            'until': until,
+            'since_Dubai': since_parsed.dt.strftime(DUBAI_DATETIME_FORMAT),
+            'until_Dubai': until_parsed.dt.strftime(DUBAI_DATETIME_FORMAT),
+        })[~invalid].astype({'since': 'int64', 'until': 'int64'}).to_dict('records')
+        for record in records:
+            log_sampled(logger, 'reservation', "<%s> Reservation of car %s: %s - %s (%s - %s)", self.company_name,
+                        record['CarKey'], record['since_Dubai'], record['until_Dubai'], record['since'],
+                        record['until'])
+        return records
+
+
+def fetch_page(client: TakamolAPIClient, processor: DataProcessor, page_number: int, page_size: int):
+    started = time.perf_counter()
+    json_data = client.fetch_data(page_number, page_size)
+    logger.info(f"<{processor.company_name}> Page {page_number} fetched in {time.perf_counter() - started:.2f}s")
+    return json_data
+
+
+def fetch_all_data(client: TakamolAPIClient, processor: DataProcessor, page_size: int = 100,
+                   max_workers: int = MAX_WORKERS) -> None:
     logger.debug(f"<{processor.company_name}> Start fetching takamol")
-    while True:
-        logger.debug(f"<{processor.company_name}> Fetching page {page_number}")
-        json_data = client.fetch_data(page_number, page_size)
-        if json_data:
-            cars = processor.parse_data(json_data)
+    # страницы запрашиваются параллельно, в sink попадают по порядку до первой пустой
+    with ThreadPoolExecutor(max_workers=max(1, max_workers)) as executor:
+        in_flight = deque()
+        # после возобновления курсоры двух таблиц могут разойтись на страницу - уже записанные страницы
+        # sink пропускает
+        next_page = min(processor.sink.next_page, processor.reservations_sink.next_page)
+        while True:
+            while len(in_flight) < max(1, max_workers):
+                logger.debug("<%s> Fetching page %s", processor.company_name, next_page)
+                in_flight.append((next_page, executor.submit(fetch_page, client, processor, next_page, page_size)))
+                next_page += 1
+            page_number, future = in_flight.popleft()
+            json_data = future.result()
+            cars = processor.parse_data(json_data) if json_data else []
             if not cars:
+                for _, pending in in_flight:
+                    pending.cancel()
                 break
-            processor.all_cars.extend(cars)
-            page_number += 1
-        else:
-            break
+            processor.sink.append_page(page_number, cars)
+            processor.reservations_sink.append_page(page_number, processor.parse_reservations(json_data))
 
 
 def save_data_to_csv(processor: DataProcessor) -> None:
-    filename = os.path.join(DATA_DIR, processor.company_name, f'takamol_cars_data_{get_current_datetime()}.csv')
-    os.makedirs(os.path.dirname(filename), exist_ok=True)
-    if processor.all_cars:
-        logger.info(f"<{processor.company_name}> {len(processor.all_cars)} cars fetched.")
-        CSVDataSaver(logger).save_dict_to_csv(processor.all_cars, filename)
+    cars_data = processor.sink.close()
+    reservations_data = processor.reservations_sink.close()
+    if not cars_data.empty:
+        logger.info(f"<{processor.company_name}> {len(cars_data)} cars and {len(reservations_data)} "
+                    f"reservations fetched.")
     else:
         logger.info(f"<{processor.company_name}> No data fetched.")
 
 
-def main(company_name, takamol_member_no, takamol_api_key) -> None:
+def main(company_name, takamol_member_no, takamol_api_key, context=None) -> None:
+    context = context or PipelineContext(company_name, logger)
     client = TakamolAPIClient(takamol_api_key, takamol_member_no)
-    processor = DataProcessor(company_name)
-    fetch_all_data(client, processor)
-    save_data_to_csv(processor)
+    filename = os.path.join(DATA_DIR, company_name, f'takamol_cars_data_{get_current_datetime()}.csv')
+    reservations_filename = os.path.join(DATA_DIR, company_name,
+                                         f'takamol_reservations_{get_current_datetime()}.csv')
+    # при исключении во время загрузки sink-и удаляют частичные файлы, следующий запуск начнет с первой страницы
+    with context.open_sink('takamol_cars', filename, CAR_COLUMNS) as sink, \
+            context.open_sink('takamol_reservations', reservations_filename, RESERVATION_COLUMNS) as reservations_sink:
+        processor = DataProcessor(company_name, sink, reservations_sink)
+        fetch_all_data(client, processor)
+        save_data_to_csv(processor)
 
 
 if __name__ == "__main__":
-    from src.main import TAKAMOL_API_KEY
+    from src.config import get_config
     company_name = "ROTANA STAR RENT A CAR"
     takamol_member_no = 2114
-    main(company_name, takamol_member_no, TAKAMOL_API_KEY)
+    main(company_name, takamol_member_no, get_config()["TAKAMOL_API_KEY"])
@@ -2,38 +2,38 @@ import os
 import pandas as pd
 from src.settings import setup_logging
 from src.config import get_current_datetime, BASE_DIR
-from src.data_helper import LatestFileFetcher
+from src.data_helper import PipelineContext, BookingsIndex
 
 script_name = os.path.splitext(os.path.basename(__file__))[0]
 logger = setup_logging(script_name)
-file_fetcher = LatestFileFetcher(logger)
 
 CARS_DIR = 'data/raw/yango_cars'
 BOOKINGS_INPUT_DIR = 'data/raw/yango_bookings'
 
 
 def load_latest_files(company_name):
+    # последние артефакты ищутся так же, как в этапах пайплайна: по манифесту, в любом artifact_format
+    context = PipelineContext(company_name, logger)
     cars_input_dir = os.path.join(BASE_DIR, CARS_DIR, company_name)
     bookings_input_dir = os.path.join(BASE_DIR, BOOKINGS_INPUT_DIR, company_name)
 
-    cars_data = file_fetcher.get_and_load_latest_csv(cars_input_dir, '*yango_cars*.csv')
-    bookings_data = file_fetcher.get_and_load_latest_csv(bookings_input_dir, '*yango_bookings*.csv')
+    cars_data = context.get('yango_cars', cars_input_dir, '*yango_cars*.csv')
+    bookings_data = context.get('yango_bookings', bookings_input_dir, '*yango_bookings*.csv')
 
     bookings_data = bookings_data[bookings_data['status_title'] != 'rental.status.on_hold.title']
 
     return cars_data, bookings_data
 
 
-def process_duplicates(duplicates, bookings_data):
+def process_duplicates(duplicates, bookings_index):
     unique_cars = []
     complex_cases = []
     remaining_duplicates = []
 
     for _, group in duplicates.groupby(['model_id', 'number']):
-        relevant_bookings = bookings_data[bookings_data['id_car'].isin(group['id'])]
+        booked_cars = group[group['id'].isin(bookings_index.cars_with_bookings())]
 
-        if not relevant_bookings.empty:
-            booked_cars = group[group['id'].isin(relevant_bookings['id_car'])]
+        if not booked_cars.empty:
             if len(booked_cars) == 1:
                 unique_cars.append(booked_cars.iloc[0])
                 remaining_duplicates.extend(group.drop(booked_cars.index).to_dict('records'))
@@ -79,7 +79,7 @@ def main(company_name):
 
     unique_cars = cars_data.drop_duplicates(subset=['model_id', 'number'], keep=False)
 
-    validated_cars, complex_cases, remaining_duplicates = process_duplicates(duplicates, bookings_data)
+    validated_cars, complex_cases, remaining_duplicates = process_duplicates(duplicates, BookingsIndex(bookings_data))
 
     validated_cars = pd.concat([validated_cars, unique_cars])
 
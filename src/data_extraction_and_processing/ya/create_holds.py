@@ -1,19 +1,28 @@
 import os
 import time
-from src.settings import setup_logging
-from src.yango_client import YangoAPIClient
+import numpy as np
+import pandas as pd
+from concurrent.futures import ThreadPoolExecutor
+from src.settings import setup_logging, log_sampled
+from src.yango_client import YangoAPIClient, HOLD_EXISTS
 from src.config import get_current_datetime, BASE_URL, BASE_DIR
-from src.data_helper import LatestFileFetcher, CSVDataSaver
+from src.metrics import metrics
+from src.hold_ledger import HoldLedger
+from src.data_helper import PipelineContext, CSVDataSaver, BookingsIndex, \
+    find_non_overlapping_intervals, expand_rows_with_intervals
 
 script_name = os.path.splitext(os.path.basename(__file__))[0]
 logger = setup_logging(script_name)
-file_fetcher = LatestFileFetcher(logger)
 
 TAG_API_URL = 'api/leasing/car/tag/add'
 MAX_RETRIES = 3
 RETRY_DELAY = 2
 MAX_RECURSION_DEPTH = 5
+MAX_IN_FLIGHT_HOLDS = 8
 HOLDS_DIR = 'data/final'
+YA_BOOKINGS_DIR = 'data/raw/yango_bookings'
+ON_HOLD_STATUS = 'rental.status.on_hold.title'
+HOLD_INTERVAL_COLUMNS = ['current_since', 'current_until', 'current_since_Dubai', 'current_until_Dubai']
 
 
 def add_tag_to_car(client, company_name, api_url, car_id, hold_start, hold_end, tag_name, hold_comment):
@@ -30,9 +39,13 @@ def add_tag_to_car(client, company_name, api_url, car_id, hold_start, hold_end,
     }
 
     for attempt in range(MAX_RETRIES):
-        logger.debug(f"<{company_name}> Sending request with params: {params} and string_params: {string_params}")
+        log_sampled(logger, 'hold_request', "<%s> Sending request with params: %s and string_params: %s",
+                    company_name, params, string_params)
         response = client.add_hold_car(api_url, params, string_params)
 
+        if response == HOLD_EXISTS:
+            logger.info(f"<{company_name}> Hold already exists for car: {car_id}")
+            return response
         if response is not None:
             if 'tagged_objects' in response and response['tagged_objects']:
                 logger.info(f"<{company_name}> Successfully added tag to car: {car_id}")
@@ -41,14 +54,39 @@ def add_tag_to_car(client, company_name, api_url, car_id, hold_start, hold_end,
                 logger.error(f"<{company_name}> Failed to add tag to car: {response}")
                 return None
         else:
-            logger.debug(f"Internal server error for {hold_comment}\n"
-                           f"Retrying {attempt + 1}/{MAX_RETRIES}...")
+            logger.debug("Internal server error for %s\nRetrying %s/%s...", hold_comment, attempt + 1, MAX_RETRIES)
             time.sleep(RETRY_DELAY)
     logger.error(f"<{company_name}> Failed to add tag to car "
                  f"after {MAX_RETRIES} attempts {hold_comment}: {params}")
     return None
 
 
+def subtract_existing_holds(company_name, ready_to_load, bookings_data):
+    # холды, уже стоящие в расписании ya, повторно не отправляем - остается только дельта
+    if ready_to_load.empty or bookings_data.empty or 'status_title' not in bookings_data:
+        return ready_to_load
+
+    on_hold_index = BookingsIndex(bookings_data[bookings_data['status_title'] == ON_HOLD_STATUS])
+    if not len(on_hold_index):
+        return ready_to_load
+
+    requested = pd.DataFrame({
+        'row': np.arange(len(ready_to_load)),
+        'ya_id': ready_to_load['ya_id'].to_numpy(),
+        'since': ready_to_load['current_since'].to_numpy(),
+        'until': ready_to_load['current_until'].to_numpy(),
+        'since_Dubai': ready_to_load['current_since_Dubai'].to_numpy(),
+        'until_Dubai': ready_to_load['current_until_Dubai'].to_numpy(),
+    })
+    delta = find_non_overlapping_intervals(requested, on_hold_index)
+    holds_delta = expand_rows_with_intervals(ready_to_load.drop(columns=HOLD_INTERVAL_COLUMNS), delta)
+
+    skipped = len(ready_to_load) - delta['row'].nunique()
+    logger.info(f"<{company_name}> Holds already placed: {skipped}, holds to send: {len(holds_delta)} "
+                f"of {len(ready_to_load)}")
+    return holds_delta
+
+
 def create_data_for_hold(data):
     records = []
     for index, row in data.iterrows():
@@ -83,6 +121,30 @@ def create_data_for_hold(data):
     return records
 
 
+def place_hold(client, company_name, tag_name, record):
+    started = time.perf_counter()
+    try:
+        response = add_tag_to_car(client, company_name, TAG_API_URL,
+                                  car_id=record['car_id'],
+                                  hold_start=record['requested_since'],
+                                  hold_end=record['requested_until'],
+                                  hold_comment=record['message'],
+                                  tag_name=tag_name)
+    except Exception as e:
+        logger.fatal(f"<{company_name}> Error add add_tag_to_car for {record}: {e}")
+        response = None
+    return response, time.perf_counter() - started
+
+
+def log_latency(company_name, latencies):
+    if not latencies:
+        return
+    latencies = sorted(latencies)
+    p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+    logger.info(f"<{company_name}> Hold request latency: avg={sum(latencies) / len(latencies):.3f}s, "
+                f"p50={latencies[len(latencies) // 2]:.3f}s, p95={p95:.3f}s, max={latencies[-1]:.3f}s")
+
+
 def truncate_timestamp(timestamp, to):
     if to not in {'microseconds'}:
         raise ValueError("Unsupported truncation level")
@@ -92,34 +154,46 @@ def truncate_timestamp(timestamp, to):
         return int(timestamp_str.ljust(16, '0'))
 
 
-def main(company_name, token_drive_ya_tech, tag_name):
+def main(company_name, token_drive_ya_tech, tag_name, context=None, max_in_flight=None):
+    context = context or PipelineContext(company_name, logger)
     client = YangoAPIClient(BASE_URL, token_drive_ya_tech, logger)
     full_dir_data_holds = os.path.join(BASE_DIR, HOLDS_DIR, company_name)
     records = []
-    ready_to_load_latest_csv = file_fetcher.get_and_load_latest_csv(full_dir_data_holds, 'ready_to_load_*.csv')
-    ready_to_load_data = create_data_for_hold(ready_to_load_latest_csv)
+    ready_to_load_latest = context.get('ready_to_load', full_dir_data_holds, 'ready_to_load_*.csv')
+    bookings_data = context.get('yango_bookings', os.path.join(BASE_DIR, YA_BOOKINGS_DIR, company_name),
+                                '*yango_bookings*.csv')
+    holds_delta = subtract_existing_holds(company_name, ready_to_load_latest, bookings_data)
+    ready_to_load_data = create_data_for_hold(holds_delta)
 
     total_records = len(ready_to_load_data)
     successful_holds = 0
+    existing_holds = 0
     failed_holds = 0
 
-    for record in ready_to_load_data:
-        try:
-            response = add_tag_to_car(client, company_name, TAG_API_URL,
-                                      car_id=record['car_id'],
-                                      hold_start=record['requested_since'],
-                                      hold_end=record['requested_until'],
-                                      hold_comment=record['message'],
-                                      tag_name=tag_name)
-            if response and response.get('tagged_objects'):
-                successful_holds += 1
-            else:
-                failed_holds += 1
-            if response is not None:
-                records.append(response)
-        except Exception as e:
-            logger.fatal(f"<{company_name}> Error add add_tag_to_car for {record}: {e}")
-            failed_holds += 1
+    latencies = []
+    with HoldLedger(company_name) as ledger:
+        ledger.prune()
+        # подтвержденные в прошлых запусках и забранные параллельным запуском холды не отправляются,
+        # прерванный запуск продолжается с первой неподтвержденной записи
+        claimed = ledger.claim(tag_name, ready_to_load_data)
+        skipped_holds = total_records - len(claimed)
+        metrics.inc('holds_ledger_skipped_total', skipped_holds, company=company_name)
+        if skipped_holds:
+            logger.info(f"<{company_name}> Holds skipped by ledger: {skipped_holds}, holds to send: {len(claimed)}")
+        with ThreadPoolExecutor(max_workers=max(1, max_in_flight or MAX_IN_FLIGHT_HOLDS)) as executor:
+            results = executor.map(lambda item: place_hold(client, company_name, tag_name, item[1]), claimed)
+            for (hold_key, _), (response, latency) in zip(claimed, results):
+                ledger.record_result(hold_key, response)
+                latencies.append(latency)
+                if response == HOLD_EXISTS:
+                    existing_holds += 1
+                    continue
+                if response and response.get('tagged_objects'):
+                    successful_holds += 1
+                else:
+                    failed_holds += 1
+                if response is not None:
+                    records.append(response)
 
     dir4records = os.path.join(full_dir_data_holds, f'successfully_records_{get_current_datetime()}.csv')
     if records:
@@ -127,8 +201,11 @@ def main(company_name, token_drive_ya_tech, tag_name):
 
     logger.info(f"<{company_name}> Records saved to {dir4records}")
     logger.info(f"<{company_name}> Total records: {total_records}")
+    logger.info(f"<{company_name}> Skipped by ledger: {skipped_holds}")
     logger.info(f"<{company_name}> Successfully placed holds: {successful_holds}")
+    logger.info(f"<{company_name}> Holds already existing in YA: {existing_holds}")
     logger.info(f"<{company_name}> Failed to place holds: {failed_holds}")
+    log_latency(company_name, latencies)
 
 
 if __name__ == "__main__":
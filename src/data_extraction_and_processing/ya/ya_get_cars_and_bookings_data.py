@@ -3,7 +3,8 @@ from datetime import datetime, timedelta
 from src.settings import setup_logging
 from src.config import get_current_datetime, BASE_DIR, BASE_URL
 from src.yango_client import YangoAPIClient
-from src.data_helper import CSVDataSaver
+from src.data_helper import PipelineContext
+from src.model_catalog import model_catalog
 
 
 LEASING_API_URL = "api/leasing/car/list"
@@ -12,31 +13,27 @@ MODEL_LIST_API_URL = "api/leasing/models/list"
 
 DATA_DIR_CARS = os.path.join(BASE_DIR, 'data/raw/yango_cars')
 DATA_DIR_BOOKINGS = os.path.join(BASE_DIR, 'data/raw/yango_bookings')
-
-os.makedirs(DATA_DIR_CARS, exist_ok=True)
-os.makedirs(DATA_DIR_BOOKINGS, exist_ok=True)
+CAR_COLUMNS = ['id', 'number', 'model_id', 'model_specifications']
 
 script_name = os.path.splitext(os.path.basename(__file__))[0]
 logger = setup_logging(script_name)
 
 
-def get_cars_leasing(client, company_name):
+def get_cars_leasing(client, company_name, context):
     logger.debug(f"<{company_name}>start get_cars_leasing")
-    cars_with_pagination = client.fetch_all_cars_with_pagination(LEASING_API_URL)
-    if cars_with_pagination:
-        logger.info(f"<{company_name}> Fetched {len(cars_with_pagination)} "
+    output_file = os.path.join(DATA_DIR_CARS, company_name, f'yango_cars_data_{get_current_datetime()}.csv')
+    with context.open_sink('yango_cars', output_file, CAR_COLUMNS) as sink:
+        client.fetch_all_cars_with_pagination(LEASING_API_URL, sink=sink)
+        cars_data = sink.close()
+    if not cars_data.empty:
+        logger.info(f"<{company_name}> Fetched {len(cars_data)} "
                     f"cars from API with pagination for company.")
-        for car in cars_with_pagination:
-            logger.debug(car)
-
-        output_file = os.path.join(DATA_DIR_CARS, company_name, f'yango_cars_data_{get_current_datetime()}.csv')
-        CSVDataSaver(logger).save_dict_to_csv(cars_with_pagination, output_file)
     else:
         logger.error(f"<{company_name}> Failed get_cars_leasing to fetch "
                      f"cars data with pagination for company.")
 
 
-def get_bookings(client, company_name):
+def get_bookings(client, company_name, context):
     logger.debug(f"<{company_name}> start get_bookings")
     now = datetime.now()
     since_timestamp = int((now - timedelta(days=10)).timestamp())
@@ -50,33 +47,27 @@ def get_bookings(client, company_name):
     logger.debug(f"<{company_name}> get_bookings params {params}")
     output_file = os.path.join(DATA_DIR_BOOKINGS, company_name, f'yango_bookings_data_{get_current_datetime()}.csv')
     all_bookings = client.fetch_bookings(BOOKINGS_API_URL, params)
-    if all_bookings:
+    if not all_bookings.empty:
         logger.info(f"<{company_name}> Fetched {len(all_bookings)} total bookings from API.")
-        for booking in all_bookings:
-            logger.debug(booking)
-        CSVDataSaver(logger).save_dict_to_csv(all_bookings, output_file)
+        context.put('yango_bookings', all_bookings, output_file)
     else:
         logger.error(f"<{company_name}> Failed get_bookings to fetch bookings data.")
 
 
 def get_model_list(client, company_name):
     logger.debug(f"start get_model_list")
-    model_list = client.fetch_model_list(MODEL_LIST_API_URL)
+    model_list = model_catalog.get_models(lambda: client.fetch_model_list(MODEL_LIST_API_URL))
     if model_list:
-        logger.info(f"<{company_name}> Fetched {len(model_list)} models from API.")
-        for model in model_list:
-            logger.debug(model)
-
-        output_file = os.path.join(DATA_DIR_CARS, company_name, f'yango_model_list_{get_current_datetime()}.csv')
-        CSVDataSaver(logger).save_dict_to_csv(model_list, output_file)
+        logger.info(f"<{company_name}> Model catalog: {len(model_list)} models.")
     else:
         logger.error(f"<{company_name}> Failed get_model_list to fetch model list.")
 
 
-def main(company_name, token_drive_ya_tech):
+def main(company_name, token_drive_ya_tech, context=None):
+    context = context or PipelineContext(company_name, logger)
     client = YangoAPIClient(BASE_URL, token_drive_ya_tech, logger)
-    get_cars_leasing(client, company_name)
-    get_bookings(client, company_name)
+    get_cars_leasing(client, company_name, context)
+    get_bookings(client, company_name, context)
     get_model_list(client, company_name)
 
 
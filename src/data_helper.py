@@ -1,19 +1,101 @@
 import os
 import csv
+import numpy as np
 import pandas as pd
 import glob
 import json
 import re
-from datetime import datetime
-from src.config import BASE_DIR
+import time
+import hashlib
+import functools
+import threading
+from src.config import BASE_DIR, get_config
 import pytz
+from datetime import datetime, timedelta
 
 TZ_DUBAI = pytz.timezone('Asia/Dubai')
+DUBAI_DATETIME_FORMAT = '%m/%d/%Y %I:%M:%S %p'
+EPOCH = datetime(1970, 1, 1)
+ARTIFACT_FORMAT = 'csv'
+ARTIFACT_EXTENSIONS = {'csv': '.csv', 'parquet': '.parquet', 'arrow': '.arrow'}
+MANIFEST_DIR = os.path.join(BASE_DIR, 'data', 'manifest')
+SINK_RESUME_MAX_AGE = 30 * 60
+# вне data/: del_old_data в начале каждого запуска удаляет оттуда все csv и json старше минуты
+SINK_PARTIAL_DIR = os.path.join(BASE_DIR, 'cache', 'partial')
+# порядок важен: замены применяются последовательно, и более поздние срабатывают на результате ранних
+# (lamborgini -> lamborghini -> lamborghinirghini), поэтому одним проходом их не заменить
+ALIAS_REPLACEMENTS = {
+    'lamborgini': 'lamborghini', 'hurracan': 'huracan',
+    'rollsroyse': 'rollsroyce', 'bentaga': 'bentayga',
+    'hurcan': 'huracan', 'lambo': 'lamborghini',
+    'chevrolete': 'chevrolet', 'culinnan': 'cullinan',
+    'hundaisantafeh': 'hundaisantafe', 'posche': 'porsche',
+    'cayean': 'cayenne', 'landroverrangrov': 'landroverrangerover'
+}
+ALIAS_PATTERN = re.compile('|'.join(re.escape(alias) for alias in ALIAS_REPLACEMENTS))
+NON_WORD_PATTERN = re.compile(r'\W+')
+PLATE_PARTS_PATTERN = re.compile(r'(?P<lead>[a-zA-Z]?)(?P<number_part>\d+)(?P<trail>[a-zA-Z]?)')
+NORMALIZE_CACHE_SIZE = 65536
+
+_manifest_lock = threading.Lock()
+
+
+def import_pyarrow():
+    # pyarrow нужен только для форматов parquet/arrow, для csv его можно не ставить
+    try:
+        import pyarrow
+        import pyarrow.ipc
+        import pyarrow.parquet
+    except ImportError as e:
+        raise ImportError("pyarrow is required for parquet/arrow artifacts: pip install pyarrow") from e
+    return pyarrow
+
+
+def is_missing_value(value):
+    return value is None or (isinstance(value, float) and np.isnan(value))
+
+
+def build_arrow_table(pa, df):
+    # схема собирается явно по колонкам; смешанные object-колонки (числа вперемешку со строками,
+    # словари с разными типами значений) пишутся строками, как их увидел бы csv
+    fields, arrays = [], []
+    for column in df.columns:
+        try:
+            array = pa.Array.from_pandas(df[column])
+        except (pa.ArrowInvalid, pa.ArrowTypeError, pa.ArrowNotImplementedError):
+            array = pa.array(df[column].map(lambda v: None if is_missing_value(v) else str(v)), type=pa.string())
+        fields.append(pa.field(str(column), array.type))
+        arrays.append(array)
+    return pa.Table.from_arrays(arrays, schema=pa.schema(fields))
+
+
+def arrow_table_to_dataframe(pa, table):
+    # вложенные колонки (списки броней, спецификации) возвращаются обычными списками и словарями
+    nested = [field.name for field in table.schema if pa.types.is_nested(field.type)]
+    data = table.drop_columns(nested).to_pandas()
+    for column in nested:
+        data[column] = table.column(column).to_pylist()
+    return data[table.column_names]
 
 
 class CSVDataSaver:
-    def __init__(self, logger):
+    def __init__(self, logger, artifact_format=None, compression=None):
+        # формат по умолчанию берется из config.json при создании, а не при импорте модуля
+        if artifact_format is None:
+            artifact_format = get_config().get('artifact_format', ARTIFACT_FORMAT)
+            compression = compression or get_config().get('artifact_compression')
         self.logger = logger
+        self.artifact_format = artifact_format
+        self.compression = compression
+        if artifact_format not in ARTIFACT_EXTENSIONS:
+            self.logger.warning(f"Unknown artifact format '{artifact_format}', falling back to csv")
+            self.artifact_format = 'csv'
+        elif artifact_format != 'csv':
+            try:
+                import_pyarrow()
+            except ImportError as e:
+                self.logger.warning(f"{e}. Falling back to csv")
+                self.artifact_format = 'csv'
 
     @staticmethod
     def get_headers(data):
@@ -43,8 +125,31 @@ class CSVDataSaver:
         try:
             df.to_csv(filename, index=False)
             self.logger.debug(f"Data saved to {filename}")
+            return filename
         except Exception as e:
             self.logger.error(f"Error saving data to CSV: {e}")
+            return None
+
+    def save_dataframe(self, df, filename):
+        # имя файла приходит с .csv, расширение меняется под выбранный формат
+        if self.artifact_format == 'csv':
+            return self.save_dataframe_to_csv(df, filename)
+        filename = os.path.splitext(filename)[0] + ARTIFACT_EXTENSIONS[self.artifact_format]
+        os.makedirs(os.path.dirname(filename), exist_ok=True)
+        try:
+            pa = import_pyarrow()
+            table = build_arrow_table(pa, df)
+            if self.artifact_format == 'parquet':
+                pa.parquet.write_table(table, filename, compression=self.compression)
+            else:
+                options = pa.ipc.IpcWriteOptions(compression=self.compression)
+                with pa.ipc.new_file(filename, table.schema, options=options) as writer:
+                    writer.write_table(table)
+            self.logger.debug(f"Data saved to {filename}")
+            return filename
+        except Exception as e:
+            self.logger.error(f"Error saving data to {self.artifact_format}: {e}")
+            return None
 
 
 class LatestFileFetcher:
@@ -78,21 +183,37 @@ class LatestFileFetcher:
             self.logger.error(f"Error loading JSON file from {directory}: {e}")
             return {}
 
+    def load_csv(self, csv_path):
+        if os.path.getsize(csv_path) == 0:
+            self.logger.debug(f"File {csv_path} is empty. Returning an empty DataFrame.")
+            return pd.DataFrame()
+
+        data = pd.read_csv(csv_path)
+        if data.empty or data.columns.empty:
+            self.logger.debug(f"File {csv_path} contains no data or no columns. Returning an empty DataFrame.")
+            return pd.DataFrame()
+
+        self.logger.debug(f"Loaded file: {csv_path}")
+        return data
+
+    def load_artifact(self, path):
+        extension = os.path.splitext(path)[1]
+        if extension == ARTIFACT_EXTENSIONS['csv']:
+            return self.load_csv(path)
+        pa = import_pyarrow()
+        if extension == ARTIFACT_EXTENSIONS['parquet']:
+            table = pa.parquet.read_table(path, memory_map=True)
+        else:
+            # arrow ipc читается через memory map без копирования файла в память
+            table = pa.ipc.open_file(pa.memory_map(path)).read_all()
+        self.logger.debug(f"Loaded file: {path}")
+        return arrow_table_to_dataframe(pa, table)
+
     def get_and_load_latest_csv(self, directory, pattern):
         self.logger.debug(f"Fetching latest CSV file from {directory} with pattern {pattern}")
         try:
             csv_path = self.get_latest_file(directory, pattern)
-            if os.path.getsize(csv_path) == 0:
-                self.logger.debug(f"File {csv_path} is empty. Returning an empty DataFrame.")
-                return pd.DataFrame()
-
-            data = pd.read_csv(csv_path)
-            if data.empty or data.columns.empty:
-                self.logger.debug(f"File {csv_path} contains no data or no columns. Returning an empty DataFrame.")
-                return pd.DataFrame()
-
-            self.logger.debug(f"Loaded file: {csv_path}")
-            return data
+            return self.load_csv(csv_path)
         except (pd.errors.EmptyDataError, FileNotFoundError) as e:
             self.logger.warning(f"File not found or is empty. Returning an empty DataFrame: {e}")
             return pd.DataFrame()
@@ -100,15 +221,131 @@ class LatestFileFetcher:
             self.logger.error(f"Error loading CSV file from {directory}: {e}")
             return pd.DataFrame()
 
-    def load_data_for_preparing_for_load_script(self, company_name):
+    def get_and_load_latest_artifact(self, directory, pattern):
+        # последний артефакт этапа в любом формате: шаблон задаётся с .csv, ищутся все расширения
+        self.logger.debug(f"Fetching latest artifact from {directory} with pattern {pattern}")
+        stem = os.path.splitext(pattern)[0]
+        try:
+            files = [file for extension in ARTIFACT_EXTENSIONS.values()
+                     for file in glob.glob(os.path.join(directory, stem + extension))]
+            if not files:
+                raise FileNotFoundError(f"No files matching the pattern {pattern} found in directory {directory}")
+            return self.load_artifact(max(files, key=os.path.getctime))
+        except (pd.errors.EmptyDataError, FileNotFoundError) as e:
+            self.logger.warning(f"File not found or is empty. Returning an empty DataFrame: {e}")
+            return pd.DataFrame()
+        except Exception as e:
+            self.logger.error(f"Error loading artifact from {directory}: {e}")
+            return pd.DataFrame()
+
+
+class ArtifactManifest:
+    # индекс последних артефактов компании: тип артефакта -> путь, схема, число строк и хэш файла.
+    # Файл заменяется атомарно, поэтому поиск последнего артефакта не обходит каталог и не зависит от ctime
+    def __init__(self, company_name, logger, manifest_dir=MANIFEST_DIR):
+        self.company_name = company_name
+        self.logger = logger
+        self.manifest_file = os.path.join(manifest_dir, f"{company_name}.json")
+
+    @staticmethod
+    def get_file_hash(filename):
+        file_hash = hashlib.sha256()
+        with open(filename, mode='rb') as file:
+            for chunk in iter(lambda: file.read(1 << 20), b''):
+                file_hash.update(chunk)
+        return file_hash.hexdigest()
+
+    def load(self):
+        try:
+            with open(self.manifest_file, mode='r', encoding='utf-8') as file:
+                return json.load(file)
+        except FileNotFoundError:
+            return {}
+        except ValueError as e:
+            self.logger.warning(f"<{self.company_name}> Artifact manifest {self.manifest_file} is broken: {e}")
+            return {}
+
+    def record(self, key, filename, data):
+        entry = {
+            'path': os.path.abspath(filename),
+            'format': os.path.splitext(filename)[1].lstrip('.'),
+            'schema': {str(column): str(dtype) for column, dtype in data.dtypes.items()},
+            'rows': len(data),
+            'content_hash': self.get_file_hash(filename),
+            'created_at': time.time()
+        }
+        os.makedirs(os.path.dirname(self.manifest_file), exist_ok=True)
+        tmp_file = f"{self.manifest_file}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with _manifest_lock:
+            manifest = self.load()
+            manifest[key] = entry
+            try:
+                with open(tmp_file, mode='w', encoding='utf-8') as file:
+                    json.dump(manifest, file, indent=4, ensure_ascii=False)
+                os.replace(tmp_file, self.manifest_file)
+            except IOError as e:
+                self.logger.error(f"<{self.company_name}> Failed to update artifact manifest: {e}")
+
+    def get_latest(self, key, directory):
+        entry = self.load().get(key)
+        if not entry:
+            return None
+        path = entry['path']
+        if os.path.dirname(path) != os.path.abspath(directory) or not os.path.exists(path):
+            return None
+        return path
+
+
+class PipelineContext:
+    # данные между этапами передаются в памяти, файлы пишутся только при persist=True
+    def __init__(self, company_name, logger, persist=True, load_from_disk=True):
+        self.company_name = company_name
+        self.logger = logger
+        self.persist = persist
+        self.load_from_disk = load_from_disk
+        self.frames = {}
+        self.file_fetcher = LatestFileFetcher(logger)
+        self.data_saver = CSVDataSaver(logger)
+        self.manifest = ArtifactManifest(company_name, logger)
+
+    def put(self, key, data, filename=None):
+        if not isinstance(data, pd.DataFrame):
+            data = pd.DataFrame(data)
+        self.frames[key] = data
+        self.logger.debug(f"<{self.company_name}> Stage data '{key}' stored in memory: {len(data)} rows")
+        if self.persist and filename:
+            saved_file = self.data_saver.save_dataframe(data, filename)
+            if saved_file:
+                self.manifest.record(key, saved_file, data)
+        return data
+
+    def open_sink(self, key, filename, columns=()):
+        return RecordSink(self, key, filename, columns)
+
+    def get(self, key, directory, pattern):
+        if key in self.frames:
+            return self.frames[key]
+        if self.load_from_disk:
+            latest_file = self.manifest.get_latest(key, directory)
+            if latest_file:
+                try:
+                    return self.file_fetcher.load_artifact(latest_file)
+                except Exception as e:
+                    self.logger.warning(f"<{self.company_name}> Error loading {latest_file} from manifest: {e}")
+            return self.file_fetcher.get_and_load_latest_artifact(directory, pattern)
+        self.logger.debug(f"<{self.company_name}> Stage data '{key}' not found in memory.")
+        return pd.DataFrame()
+
+    def load_data_for_preparing_for_load_script(self):
         YA_BOOKINGS_DIR = 'data/raw/yango_bookings'
         MATCHED_DATA_DIR = 'data/processing/yango_cars'
-        bookings_data = self.get_and_load_latest_csv(os.path.join(BASE_DIR, YA_BOOKINGS_DIR, company_name),
-                                                     '*yango_bookings*.csv')
-        matched_data = self.get_and_load_latest_csv(os.path.join(BASE_DIR, MATCHED_DATA_DIR, company_name),
-                                                    '*_matched_*.csv')
-        ya_unmatched_data = self.get_and_load_latest_csv(os.path.join(BASE_DIR, MATCHED_DATA_DIR, company_name),
-                                                    '*_failed_*.csv')
+        company_name = self.company_name
+        bookings_data = self.get('yango_bookings', os.path.join(BASE_DIR, YA_BOOKINGS_DIR, company_name),
+                                 '*yango_bookings*.csv')
+        matched_data = self.get('matched', os.path.join(BASE_DIR, MATCHED_DATA_DIR, company_name),
+                                '*_matched_*.csv')
+        ya_unmatched_data = self.get('failed_yango', os.path.join(BASE_DIR, MATCHED_DATA_DIR, company_name),
+                                     '*_failed_*.csv')
 
         if bookings_data.empty:
             self.logger.warning(f"{company_name} Данные бронирований не найдены или пусты.")
@@ -122,6 +359,172 @@ class LatestFileFetcher:
         return bookings_data, matched_data, ya_unmatched_data
 
 
+class ColumnarBuilder:
+    # строки раскладываются сразу по колонкам, без промежуточного списка словарей;
+    # отсутствующие в строке поля заполняются NaN, как в pd.DataFrame(list_of_dicts)
+    def __init__(self, columns=()):
+        self.columns = {column: [] for column in columns}
+        self.rows = 0
+
+    def __len__(self):
+        return self.rows
+
+    def append(self, row):
+        for key, value in row.items():
+            column = self.columns.get(key)
+            if column is None:
+                column = self.columns[key] = [np.nan] * self.rows
+            column.append(value)
+        self.rows += 1
+        for column in self.columns.values():
+            if len(column) < self.rows:
+                column.append(np.nan)
+
+    def to_dataframe(self):
+        return pd.DataFrame(self.columns)
+
+
+class RecordSink:
+    # страницы пишутся по мере получения в частичный файл (json lines, по строке на запись - типы значений
+    # сохраняются как есть) с заранее объявленной схемой; после каждой страницы сохраняется курсор, так что
+    # загрузка, прерванная падением процесса, продолжается со следующей страницы. Если загрузка завершилась
+    # исключением, частичный файл и курсор удаляются: следующий запуск начинает с первой страницы.
+    # Строки, кроме того, собираются в ColumnarBuilder: следующий этап получает таблицу из памяти,
+    # поэтому память по-прежнему растет с размером парка - экономится только список словарей всех страниц
+    def __init__(self, context, key, filename, columns=(), resume_max_age=SINK_RESUME_MAX_AGE):
+        self.context = context
+        self.key = key
+        self.filename = filename
+        self.logger = context.logger
+        self.persist = context.persist
+        self.columns = list(columns)
+        self.schema_fixed = False
+        self.dropped_columns = set()
+        self.builder = None
+        self.file = None
+        self.rows = 0
+        self.next_page = 1
+        directory = os.path.join(SINK_PARTIAL_DIR, context.company_name)
+        self.partial_file = os.path.join(directory, f'{key}.partial.jsonl')
+        self.cursor_file = os.path.join(directory, f'{key}.cursor.json')
+        if self.persist:
+            self.resume(resume_max_age)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None and issubclass(exc_type, Exception):
+            self.abort()
+        elif self.file:
+            # KeyboardInterrupt/SystemExit: курсор остается, следующий запуск продолжит загрузку
+            self.file.close()
+            self.file = None
+
+    def resume(self, resume_max_age):
+        try:
+            with open(self.cursor_file, mode='r', encoding='utf-8') as file:
+                cursor = json.load(file)
+            if time.time() - cursor['updated_at'] > resume_max_age or not os.path.exists(self.partial_file):
+                raise ValueError("cursor is stale")
+        except FileNotFoundError:
+            return
+        except (ValueError, KeyError) as e:
+            self.logger.debug(f"<{self.context.company_name}> Discarding partial '{self.key}': {e}")
+            self.discard()
+            return
+        # всё, что записано после последнего курсора, относится к недописанной странице
+        with open(self.partial_file, mode='r+b') as file:
+            file.truncate(cursor['offset'])
+        self.columns = cursor['columns']
+        self.schema_fixed = True
+        self.builder = ColumnarBuilder(self.columns)
+        with open(self.partial_file, mode='r', encoding='utf-8') as file:
+            for line in file:
+                self.builder.append(json.loads(line))
+        self.rows = cursor['rows']
+        self.next_page = cursor['next_page']
+        self.file = open(self.partial_file, mode='a', encoding='utf-8')
+        self.logger.info(f"<{self.context.company_name}> Resuming '{self.key}' from page {self.next_page}, "
+                         f"{self.rows} rows already saved")
+
+    def fix_schema(self, records):
+        # объявленные колонки идут первыми, поля первой страницы вне схемы добавляются в порядке появления
+        for record in records:
+            for column in record:
+                if column not in self.columns:
+                    self.columns.append(column)
+        self.schema_fixed = True
+        if self.persist:
+            os.makedirs(os.path.dirname(self.partial_file), exist_ok=True)
+            self.file = open(self.partial_file, mode='w', encoding='utf-8')
+
+    def append_page(self, page_number, records):
+        if page_number < self.next_page:
+            # страница уже сохранена до перезапуска
+            return
+        if not self.schema_fixed:
+            self.fix_schema(records)
+        if self.builder is None:
+            self.builder = ColumnarBuilder(self.columns)
+        for record in records:
+            unknown = record.keys() - self.dropped_columns - set(self.columns)
+            if unknown:
+                self.dropped_columns.update(unknown)
+                self.logger.warning(f"<{self.context.company_name}> Fields {sorted(unknown)} are not in "
+                                    f"'{self.key}' schema and are dropped")
+            row = {column: record[column] for column in self.columns if column in record}
+            self.builder.append(row)
+            if self.file:
+                self.file.write(json.dumps(row, default=str) + '\n')
+        self.rows += len(records)
+        self.next_page = page_number + 1
+        if self.file:
+            self.file.flush()
+            self.save_cursor()
+
+    def save_cursor(self):
+        cursor = {'next_page': self.next_page, 'rows': self.rows, 'offset': self.file.tell(),
+                  'columns': self.columns, 'updated_at': time.time()}
+        tmp_file = f"{self.cursor_file}.{os.getpid()}.tmp"
+        with open(tmp_file, mode='w', encoding='utf-8') as file:
+            json.dump(cursor, file)
+        os.replace(tmp_file, self.cursor_file)
+
+    def discard(self):
+        for path in (self.partial_file, self.cursor_file):
+            if os.path.exists(path):
+                os.remove(path)
+
+    def abort(self):
+        # загрузка упала с исключением: страницы этого запуска не продолжаются следующим
+        if self.file:
+            self.file.close()
+            self.file = None
+        if self.persist:
+            self.discard()
+        self.logger.warning(f"<{self.context.company_name}> Fetching '{self.key}' failed, "
+                            f"{self.rows} fetched rows discarded")
+
+    def close(self):
+        if self.file:
+            self.file.close()
+            self.file = None
+        data = self.builder.to_dataframe() if self.builder else pd.DataFrame()
+        if data.empty:
+            if self.persist:
+                self.discard()
+            return data
+        self.context.frames[self.key] = data
+        if self.persist:
+            saved_file = self.context.data_saver.save_dataframe(data, self.filename)
+            if saved_file:
+                self.context.manifest.record(self.key, saved_file, data)
+            self.discard()
+        self.logger.debug(f"<{self.context.company_name}> Stage data '{self.key}' stored in memory: "
+                          f"{len(data)} rows")
+        return data
+
 
 class JSONDataSaver:
     def __init__(self, logger):
@@ -163,15 +566,6 @@ class DataNormalizer:
             return match.group(0)
         return None
 
-    @staticmethod
-    def convert_to_json_format(text):
-        if text:
-            text = re.sub(r"'", '"', text)
-            text = re.sub(r'None', 'null', text)
-            text = re.sub(r'True', 'true', text)
-            text = re.sub(r'False', 'false', text)
-        return text
-
     @staticmethod
     def extract_letter_part(plate_no):
         match = re.findall(r'[a-zA-Z]', plate_no)
@@ -184,79 +578,234 @@ class DataNormalizer:
 
     @staticmethod
     def normalize_string(s):
-        s = re.sub(r'\W+', '', str(s).lower())
-        replacements = {
-            'lamborgini': 'lamborghini', 'hurracan': 'huracan',
-            'rollsroyse': 'rollsroyce', 'bentaga': 'bentayga',
-            'hurcan': 'huracan', 'lambo': 'lamborghini',
-            'chevrolete': 'chevrolet', 'culinnan': 'cullinan',
-            'hundaisantafeh': 'hundaisantafe', 'posche': 'porsche',
-            'cayean': 'cayenne', 'landroverrangrov': 'landroverrangerover'
-        }
-        for old, new in replacements.items():
-            s = s.replace(old, new)
-        return s
+        return normalize_text(s if isinstance(s, str) else str(s))
 
+    @staticmethod
+    def normalize_series(values):
+        # то же, что normalize_string для каждого значения: \W и регистр - через .str, а замены опечаток
+        # только для строк, где автомат ALIAS_PATTERN нашел хотя бы одну (в номерах их не бывает)
+        normalized = pd.Series(values, dtype=object).astype(str).str.lower().str.replace(NON_WORD_PATTERN, '',
+                                                                                         regex=True)
+        with_aliases = normalized.str.contains(ALIAS_PATTERN)
+        if with_aliases.any():
+            normalized[with_aliases] = normalized[with_aliases].map(apply_aliases)
+        return normalized
 
-def safe_json_loads(x, logger):
-    try:
-        if pd.isna(x):
-            return []
-        x = DataNormalizer.convert_to_json_format(x)
-        return json.loads(x)
-    except json.JSONDecodeError as e:
-        logger.error(f"Ошибка декодирования JSON: {x} — {e}")
-        return []
-
-
-def find_non_overlapping_intervals(new_intervals, existing_intervals, ya_id, logger):
-    result_intervals = []
-
-    for new_start, new_end, new_start_dubai, new_end_dubai in new_intervals:
-        logger.debug(f"Processing new interval: [{new_start}, {new_end}] (Dubai: {new_start_dubai} - {new_end_dubai})")
-        current_intervals = [(new_start, new_end, new_start_dubai, new_end_dubai)]
-
-        for exist_start, exist_end in existing_intervals:
-            logger.debug(f"Checking against existing interval: [{exist_start}, {exist_end}]")
-            next_intervals = []
-            for interval in current_intervals:
-                interval_start, interval_end, interval_start_dubai, interval_end_dubai = interval
-                if interval_end <= exist_start or interval_start >= exist_end:
-                    next_intervals.append(interval)
-                else:
-                    logger.debug(f"Found overlapping interval with existing [{exist_start}, {exist_end}]")
-                    if interval_start < exist_start:
-                        next_intervals.append((interval_start, exist_start, interval_start_dubai,
-                                    datetime.fromtimestamp(exist_start, TZ_DUBAI).strftime('%m/%d/%Y %I:%M:%S %p')))
-                    if interval_end > exist_end:
-                        next_intervals.append((exist_end, interval_end,
-                                    datetime.fromtimestamp(exist_end, TZ_DUBAI).strftime('%m/%d/%Y %I:%M:%S %p'),
-                                               interval_end_dubai))
-
-            current_intervals = next_intervals
-            logger.debug(f"Remaining intervals after comparison: {current_intervals}")
+    @staticmethod
+    def normalize_plates(plates, manufacturers=()):
+        # за один проход: нормализованный номер, его основная часть (буква-цифры-буква), цифры, буква
+        # (как extract_letter_part - последняя из букв основной части) и нормализованный производитель/название
+        plate = DataNormalizer.normalize_series(plates)
+        parts = plate.str.extract(PLATE_PARTS_PATTERN)
+        letter_part = parts['trail'].where(parts['trail'] != '', parts['lead'])
+        # колонки собираются по позициям: индекс исходных данных может быть с повторами
+        return pd.DataFrame({
+            'plate': plate.to_numpy(),
+            'main_part': (parts['lead'] + parts['number_part'] + parts['trail']).to_numpy(),
+            'number_part': parts['number_part'].to_numpy(),
+            'letter_part': letter_part.where(letter_part != '').to_numpy(),
+            'manufacturer': DataNormalizer.normalize_series(manufacturers).to_numpy() if len(manufacturers) else None,
+        }, index=plate.index)
+
+
+def apply_aliases(s):
+    for old, new in ALIAS_REPLACEMENTS.items():
+        s = s.replace(old, new)
+    return s
+
+
+@functools.lru_cache(maxsize=NORMALIZE_CACHE_SIZE)
+def normalize_text(text):
+    # одни и те же номера и названия нормализуются много раз за запуск, кэш ограничен по размеру
+    s = NON_WORD_PATTERN.sub('', text.lower())
+    return apply_aliases(s) if ALIAS_PATTERN.search(s) else s
+
+
+def format_dubai_datetime(timestamps):
+    return pd.to_datetime(np.asarray(timestamps, dtype=np.int64), unit='s', utc=True) \
+        .tz_convert(TZ_DUBAI).strftime(DUBAI_DATETIME_FORMAT).to_numpy(dtype=object)
+
+
+def parse_local_datetimes(values, datetime_format=DUBAI_DATETIME_FORMAT):
+    # векторный аналог int(datetime.strptime(value, datetime_format).timestamp()): время без зоны
+    # трактуется как локальное время процесса, смещение зоны считается один раз на каждый уникальный час.
+    # Возвращает разобранные даты (NaT при ошибке) и epoch-секунды (Int64, <NA> при ошибке)
+    parsed = pd.to_datetime(pd.Series(values, dtype=object), format=datetime_format, errors='coerce')
+    valid = parsed.notna().to_numpy()
+    naive = ((parsed[valid] - pd.Timestamp(0)) // pd.Timedelta(seconds=1)).to_numpy(dtype=np.int64)
+    hours, positions = np.unique(naive // 3600 * 3600, return_inverse=True)
+    offsets = np.array([int((EPOCH + timedelta(seconds=int(hour))).timestamp()) - hour for hour in hours],
+                       dtype=np.int64)
+    epoch = pd.Series(pd.NA, index=parsed.index, dtype='Int64')
+    epoch[valid] = naive + offsets[positions.reshape(-1)] if len(naive) else naive
+    return parsed, epoch
+
+
+def _interval_encoding(*value_arrays, key_count):
+    # ключ и время кодируются одним int64: key * span + (value - offset),
+    # так сортировка и searchsorted идут сразу по (ключ, время) для всего парка
+    values = np.concatenate([np.asarray(v, dtype=np.int64) for v in value_arrays] + [np.zeros(1, dtype=np.int64)])
+    offset = int(values.min())
+    span = int(values.max()) - offset + 1
+    if (key_count + 1) * span >= 2 ** 62:
+        raise ValueError("Interval values are out of range for int64 encoding")
+    return offset, span
 
-        result_intervals.extend(current_intervals)
-        logger.debug(f"Non-overlapping intervals so far: {result_intervals}")
 
-    logger.debug(f"Final resulting non-overlapping intervals fro {ya_id}: {result_intervals}")
-    return result_intervals
+def merge_overlapping_intervals(intervals):
+    # intervals: DataFrame с колонками row, since, until, since_Dubai, until_Dubai;
+    # пересекающиеся и касающиеся интервалы одной строки склеиваются
+    if intervals.empty:
+        return intervals.copy()
+
+    rows = intervals['row'].to_numpy(dtype=np.int64)
+    since = intervals['since'].to_numpy(dtype=np.int64)
+    until = intervals['until'].to_numpy(dtype=np.int64)
+    order = np.lexsort((since, rows))
+    rows, since, until = rows[order], since[order], until[order]
+
+    offset, span = _interval_encoding(since, until, key_count=int(rows.max()) + 1)
+    encoded_since = rows * span + (since - offset)
+    running_until = np.maximum.accumulate(rows * span + (until - offset))
+    heads = np.flatnonzero(np.concatenate(([True], encoded_since[1:] > running_until[:-1])))
+    tails = np.append(heads[1:], len(rows)) - 1
+
+    return pd.DataFrame({
+        'row': rows[heads],
+        'since': since[heads],
+        'until': np.maximum.reduceat(until, heads),
+        'since_Dubai': intervals['since_Dubai'].to_numpy(dtype=object)[order][heads],
+        'until_Dubai': intervals['until_Dubai'].to_numpy(dtype=object)[order][tails],
+    })
 
 
-def merge_overlapping_intervals(intervals):
-    if not intervals:
-        return []
+def merge_booked_intervals(codes, since, until):
+    # на входе брони, отсортированные по (код авто, since); склеиваются только строго пересекающиеся,
+    # касающиеся брони остаются отдельными блоками
+    if not len(codes):
+        return codes, since, until
+    offset, span = _interval_encoding(since, until, key_count=int(codes.max()) + 1)
+    encoded_since = codes * span + (since - offset)
+    running_until = np.maximum.accumulate(codes * span + (until - offset))
+    heads = np.flatnonzero(np.concatenate(([True], encoded_since[1:] >= running_until[:-1])))
+    return codes[heads], since[heads], np.maximum.reduceat(until, heads)
+
+
+def subtract_intervals(request_codes, request_since, request_until, block_codes, block_since, block_until):
+    # вычитает из каждого запрошенного интервала [since, until) занятые блоки того же кода авто;
+    # возвращает позиции запросов и непокрытые отрезки в порядке запросов, внутри запроса - по возрастанию
+    request_codes = np.asarray(request_codes, dtype=np.int64)
+    request_since = np.asarray(request_since, dtype=np.int64)
+    request_until = np.asarray(request_until, dtype=np.int64)
+
+    offset, span = _interval_encoding(request_since, request_until, block_since, block_until,
+                                      key_count=max(int(block_codes.max()) if len(block_codes) else 0,
+                                                    int(request_codes.max()) if len(request_codes) else 0) + 1)
+    encoded_block_since = block_codes * span + (block_since - offset)
+    encoded_block_until = block_codes * span + (block_until - offset)
+
+    first = np.searchsorted(encoded_block_until, request_codes * span + (request_since - offset), side='right')
+    last = np.searchsorted(encoded_block_since, request_codes * span + (request_until - offset), side='left')
+    counts = np.maximum(last - first, 0)
+
+    positions = np.repeat(np.arange(len(request_since)), counts + 1)
+    starts = np.concatenate(([0], np.cumsum(counts + 1)[:-1])) if len(counts) else counts
+    step = np.arange(len(positions)) - np.repeat(starts, counts + 1)
+    piece_counts = counts[positions]
+    piece_first = first[positions]
+
+    block_since = np.append(block_since, 0)
+    block_until = np.append(block_until, 0)
+    is_request_since = step == 0
+    is_request_until = step == piece_counts
+    since = np.where(is_request_since, request_since[positions], block_until[piece_first + step - 1])
+    until = np.where(is_request_until, request_until[positions], block_since[piece_first + step])
+
+    keep = (since < until) | (piece_counts == 0)
+    return positions[keep], since[keep], until[keep], is_request_since[keep], is_request_until[keep]
+
+
+class BookingsIndex:
+    # брони ya группируются по id_car один раз: отсортированные since/until и склеенные занятые блоки
+    def __init__(self, bookings_data):
+        if bookings_data.empty or 'id_car' not in bookings_data:
+            bookings_data = pd.DataFrame({'id_car': [], 'since': [], 'until': []})
+        self.booked_cars = pd.Index(bookings_data['id_car'].dropna().unique())
+
+        bookings = bookings_data[['id_car', 'since', 'until']].dropna()
+        self.car_ids = pd.Index(bookings['id_car'].unique())
+        codes = self.car_ids.get_indexer(bookings['id_car']).astype(np.int64)
+        since = bookings['since'].to_numpy(dtype=np.int64)
+        until = bookings['until'].to_numpy(dtype=np.int64)
+        order = np.lexsort((since, codes))
+        self.codes, self.since, self.until = codes[order], since[order], until[order]
+        self.bounds = np.searchsorted(self.codes, np.arange(len(self.car_ids) + 1))
+
+        valid = self.since < self.until
+        self.block_codes, self.block_since, self.block_until = \
+            merge_booked_intervals(self.codes[valid], self.since[valid], self.until[valid])
+        self.block_bounds = np.searchsorted(self.block_codes, np.arange(len(self.car_ids) + 1))
+
+    def __len__(self):
+        return len(self.codes)
+
+    def car_code(self, car_id):
+        return self.car_ids.get_loc(car_id) if car_id in self.car_ids else -1
+
+    def has_bookings(self, car_id):
+        return car_id in self.booked_cars
+
+    def cars_with_bookings(self):
+        return self.booked_cars
+
+    def intervals(self, car_id):
+        code = self.car_code(car_id)
+        if code < 0:
+            return []
+        start, end = self.bounds[code], self.bounds[code + 1]
+        return [[since, until] for since, until in zip(self.since[start:end].tolist(), self.until[start:end].tolist())]
+
+    def overlaps(self, car_id, since, until):
+        code = self.car_code(car_id)
+        if code < 0:
+            return False
+        start, end = self.block_bounds[code], self.block_bounds[code + 1]
+        position = start + np.searchsorted(self.block_until[start:end], since, side='right')
+        return bool(position < end and self.block_since[position] < until)
+
+    def subtract(self, car_ids, since, until):
+        request_codes = self.car_ids.get_indexer(pd.Index(car_ids, dtype=object))
+        return subtract_intervals(request_codes, since, until, self.block_codes, self.block_since, self.block_until)
+
+
+def find_non_overlapping_intervals(requested, bookings_index):
+    # requested: DataFrame с колонками row, ya_id, since, until, since_Dubai, until_Dubai;
+    # строки Dubai форматируются только для границ, взятых из существующих броней
+    if requested.empty:
+        return pd.DataFrame(columns=['row', 'current_since', 'current_until',
+                                     'current_since_Dubai', 'current_until_Dubai'])
+
+    positions, since, until, is_request_since, is_request_until = bookings_index.subtract(
+        requested['ya_id'].to_numpy(dtype=object), requested['since'], requested['until'])
+
+    since_dubai = requested['since_Dubai'].to_numpy(dtype=object)[positions]
+    until_dubai = requested['until_Dubai'].to_numpy(dtype=object)[positions]
+    since_dubai[~is_request_since] = format_dubai_datetime(since[~is_request_since])
+    until_dubai[~is_request_until] = format_dubai_datetime(until[~is_request_until])
+
+    return pd.DataFrame({
+        'row': requested['row'].to_numpy()[positions],
+        'current_since': since,
+        'current_until': until,
+        'current_since_Dubai': since_dubai,
+        'current_until_Dubai': until_dubai,
+    })
 
-    sorted_intervals = sorted(intervals, key=lambda x: x[0])
-    merged_intervals = [sorted_intervals[0]]
 
-    for current in sorted_intervals[1:]:
-        last = merged_intervals[-1]
-        if current[0] <= last[1]:
-            merged_intervals[-1] = (last[0], max(last[1], current[1]), last[2], current[3])
-        else:
-            merged_intervals.append(current)
-    return merged_intervals
+def expand_rows_with_intervals(data, intervals):
+    # каждая строка data повторяется для каждого своего интервала, колонки интервала добавляются в конец
+    expanded = data.iloc[intervals['row'].to_numpy(dtype=np.int64)]
+    return expanded.assign(**{column: intervals[column].to_numpy() for column in intervals.columns if column != 'row'})
 
 
 def merge_matched_and_ya_unmatched_data(matched_data, ya_unmatched_data):
@@ -0,0 +1,156 @@
+import os
+import json
+import time
+import uuid
+import sqlite3
+import hashlib
+from src.settings import setup_logging
+from src.config import BASE_DIR
+from src.yango_client import HOLD_EXISTS
+
+script_name = os.path.splitext(os.path.basename(__file__))[0]
+logger = setup_logging(script_name)
+
+LEDGER_FILE = os.path.join(BASE_DIR, 'data', 'ledger', 'holds.sqlite3')
+CLAIM_TTL = 15 * 60
+RETENTION = 7 * 24 * 60 * 60
+STATUS_IN_FLIGHT = 'in_flight'
+STATUS_CONFIRMED = 'confirmed'
+STATUS_FAILED = 'failed'
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS holds (
+    hold_key TEXT PRIMARY KEY,
+    company TEXT NOT NULL,
+    car_id TEXT NOT NULL,
+    tag_name TEXT,
+    since INTEGER NOT NULL,
+    until INTEGER NOT NULL,
+    status TEXT NOT NULL,
+    run_id TEXT,
+    owner_pid INTEGER,
+    attempts INTEGER NOT NULL DEFAULT 0,
+    response TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+)
+"""
+
+
+def is_process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+
+class HoldLedger:
+    # журнал отправленных холдов: ключ - хэш (компания, тег, авто, интервал), статус и ответ api.
+    # Подтвержденные холды повторно не отправляются; перед отправкой запуск забирает записи себе
+    # (in_flight на CLAIM_TTL), так что параллельный запуск той же компании их пропустит
+    def __init__(self, company_name, ledger_file=LEDGER_FILE, claim_ttl=CLAIM_TTL):
+        self.company_name = company_name
+        self.claim_ttl = claim_ttl
+        self.run_id = uuid.uuid4().hex
+        os.makedirs(os.path.dirname(ledger_file), exist_ok=True)
+        self.connection = sqlite3.connect(ledger_file, timeout=30)
+        self.connection.execute('PRAGMA journal_mode=WAL')
+        self.connection.execute('PRAGMA synchronous=NORMAL')
+        with self.connection:
+            self.connection.execute(SCHEMA)
+
+    def close(self):
+        # записи, по которым запуск так и не получил ответ (исключение посреди цикла), снова доступны
+        with self.connection:
+            self.connection.execute("UPDATE holds SET status = ?, updated_at = ? WHERE run_id = ? AND status = ?",
+                                    (STATUS_FAILED, time.time(), self.run_id, STATUS_IN_FLIGHT))
+        self.connection.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+    def get_hold_key(self, tag_name, record):
+        content = json.dumps([self.company_name, tag_name, str(record['car_id']),
+                              int(record['requested_since']), int(record['requested_until'])])
+        return hashlib.sha256(content.encode('utf-8')).hexdigest()
+
+    def claim(self, tag_name, records):
+        # возвращает записи, которые этот запуск должен отправить, в исходном порядке
+        now = time.time()
+        # одинаковые холды внутри запуска отправляются один раз
+        unique = {}
+        for record in records:
+            unique.setdefault(self.get_hold_key(tag_name, record), record)
+        keys, records = list(unique), list(unique.values())
+        self.release_dead_claims()
+        with self.connection:
+            self.connection.executemany(
+                """
+                INSERT INTO holds (hold_key, company, car_id, tag_name, since, until, status, run_id,
+                                   owner_pid, created_at, updated_at)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+                ON CONFLICT(hold_key) DO UPDATE SET status = excluded.status, run_id = excluded.run_id,
+                                                    owner_pid = excluded.owner_pid,
+                                                    updated_at = excluded.updated_at
+                WHERE holds.status = ? OR (holds.status = ? AND holds.updated_at < ?)
+                """,
+                [(key, self.company_name, str(record['car_id']), tag_name, int(record['requested_since']),
+                  int(record['requested_until']), STATUS_IN_FLIGHT, self.run_id, os.getpid(), now, now,
+                  STATUS_FAILED, STATUS_IN_FLIGHT, now - self.claim_ttl)
+                 for key, record in zip(keys, records)])
+        claimed = self.get_claimed_keys(keys)
+        return [(key, record) for key, record in zip(keys, records) if key in claimed]
+
+    def release_dead_claims(self):
+        # процесс, упавший посреди отправки, не дождется ответа: его записи сразу доступны для повтора
+        owners = [row[0] for row in self.connection.execute(
+            "SELECT DISTINCT owner_pid FROM holds WHERE company = ? AND status = ?",
+            (self.company_name, STATUS_IN_FLIGHT))]
+        dead = [pid for pid in owners if pid is not None and not is_process_alive(pid)]
+        if not dead:
+            return
+        with self.connection:
+            released = self.connection.execute(
+                f"UPDATE holds SET status = ?, updated_at = ? WHERE company = ? AND status = ? "
+                f"AND owner_pid IN ({','.join('?' * len(dead))})",
+                [STATUS_FAILED, time.time(), self.company_name, STATUS_IN_FLIGHT, *dead]).rowcount
+        logger.info(f"<{self.company_name}> Released {released} holds claimed by finished processes {dead}")
+
+    def get_claimed_keys(self, keys):
+        claimed = set()
+        # sqlite ограничивает число параметров в запросе
+        for start in range(0, len(keys), 500):
+            chunk = keys[start:start + 500]
+            rows = self.connection.execute(
+                f"SELECT hold_key FROM holds WHERE run_id = ? AND status = ? "
+                f"AND hold_key IN ({','.join('?' * len(chunk))})", [self.run_id, STATUS_IN_FLIGHT, *chunk])
+            claimed.update(row[0] for row in rows)
+        return claimed
+
+    def record_result(self, hold_key, response):
+        # 409 - холд уже стоит в ya, повторно отправлять его нечего
+        confirmed = response == HOLD_EXISTS or bool(response and response.get('tagged_objects'))
+        status = STATUS_CONFIRMED if confirmed else STATUS_FAILED
+        with self.connection:
+            self.connection.execute(
+                "UPDATE holds SET status = ?, attempts = attempts + 1, response = ?, updated_at = ? "
+                "WHERE hold_key = ? AND run_id = ?",
+                (status, json.dumps(response, ensure_ascii=False) if response is not None else None, time.time(),
+                 hold_key, self.run_id))
+        return status
+
+    def prune(self, retention=RETENTION):
+        # холды, которые давно закончились, больше не могут прийти повторно; until - в микросекундах
+        until = int((time.time() - retention) * 1000000)
+        with self.connection:
+            deleted = self.connection.execute("DELETE FROM holds WHERE company = ? AND until < ?",
+                                              (self.company_name, until)).rowcount
+        if deleted:
+            logger.debug(f"<{self.company_name}> Pruned {deleted} expired holds from ledger")
+        return deleted
@@ -0,0 +1,76 @@
+import time
+import threading
+import requests
+from urllib.parse import urlparse
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+from src.metrics import metrics
+
+POOL_CONNECTIONS = 10
+POOL_MAXSIZE = 32
+REQUEST_TIMEOUT = (10, 120)
+RETRY_TOTAL = 5
+RETRY_BACKOFF_FACTOR = 1
+RETRY_STATUS_FORCELIST = [429, 500, 502, 503, 504]
+
+_adapter = None
+_adapter_lock = threading.Lock()
+_pool_maxsize = POOL_MAXSIZE
+
+
+class TimeoutHTTPAdapter(HTTPAdapter):
+    def __init__(self, *args, timeout=REQUEST_TIMEOUT, **kwargs):
+        self.timeout = timeout
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, **kwargs):
+        if kwargs.get('timeout') is None:
+            kwargs['timeout'] = self.timeout
+        # задержка, ответы и повторы считаются по endpoint для всех клиентов, которые ходят через адаптер
+        endpoint = urlparse(request.url).path
+        started = time.perf_counter()
+        try:
+            response = super().send(request, **kwargs)
+        except Exception as e:
+            metrics.inc('http_errors_total', endpoint=endpoint, method=request.method, error=type(e).__name__)
+            raise
+        finally:
+            metrics.observe('http_request_duration_seconds', time.perf_counter() - started,
+                            endpoint=endpoint, method=request.method)
+        retries = getattr(getattr(response.raw, 'retries', None), 'history', None)
+        if retries:
+            metrics.inc('http_retries_total', len(retries), endpoint=endpoint, method=request.method)
+        metrics.inc('http_requests_total', endpoint=endpoint, method=request.method, status=response.status_code)
+        return response
+
+
+def configure_pool(parallel_requests):
+    # пул на хост должен вмещать все одновременные запросы процесса, иначе лишние соединения после ответа
+    # закрываются (urllib3 "Connection pool is full") и keep-alive теряется. Вызывается до старта воркеров
+    global _pool_maxsize
+    with _adapter_lock:
+        _pool_maxsize = max(POOL_MAXSIZE, parallel_requests)
+        if _adapter is not None and _adapter._pool_maxsize < _pool_maxsize:
+            _adapter.init_poolmanager(POOL_CONNECTIONS, _pool_maxsize, block=_adapter._pool_block)
+
+
+def get_shared_adapter():
+    # один пул keep-alive соединений на хост для всех клиентов, этапов и компаний в процессе
+    global _adapter
+    with _adapter_lock:
+        if _adapter is None:
+            retries = Retry(total=RETRY_TOTAL, backoff_factor=RETRY_BACKOFF_FACTOR,
+                            status_forcelist=RETRY_STATUS_FORCELIST)
+            _adapter = TimeoutHTTPAdapter(max_retries=retries, pool_connections=POOL_CONNECTIONS,
+                                          pool_maxsize=_pool_maxsize)
+        return _adapter
+
+
+def create_session(headers=None) -> requests.Session:
+    session = requests.Session()
+    adapter = get_shared_adapter()
+    session.mount('http://', adapter)
+    session.mount('https://', adapter)
+    if headers:
+        session.headers.update(headers)
+    return session
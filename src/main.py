@@ -1,82 +1,192 @@
-import pytz
 import os
-from settings import setup_logging
-from config import _config_json
-from concurrent.futures import ThreadPoolExecutor
-from src.data_extraction_and_processing.ya import ya_get_cars_and_bookings_data, ya_data_join, create_holds
-from src.data_extraction_and_processing.takamol import takamol_get_car_bookings_data, \
-                                        takamol_data_processing, takamol_data_matcher, takamol_prepare_for_loading
-from src.data_extraction_and_processing.docs_google import google_sheets_client, google_sheets_data_matcher, \
-                                        google_sheets_prepare_for_loading
+import sys
+import time
+import importlib
+import multiprocessing
+from src.settings import setup_logging
+from src.config import get_config
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
 from src.data_extraction_and_processing import del_old_data
-
-pytz.timezone('Asia/Dubai')
+from src.metrics import metrics, MetricsRegistry
 
 script_name = os.path.splitext(os.path.basename(__file__))[0]
 logger = setup_logging(script_name)
 
-TAKAMOL_API_KEY = _config_json["TAKAMOL_API_KEY"]
+# этап -> (модуль, функция). Модуль этапа импортируется при первом запуске этапа: компания без takamol
+# не тянет клиента takamol, компания без google sheets - gspread и oauth2client
+STAGES = {
+    'ya_get_cars_and_bookings_data': ('src.data_extraction_and_processing.ya.ya_get_cars_and_bookings_data', 'main'),
+    'ya_data_join': ('src.data_extraction_and_processing.ya.ya_data_join', 'merge_csv_files'),
+    'takamol_get_car_bookings_data': ('src.data_extraction_and_processing.takamol.takamol_get_car_bookings_data',
+                                      'main'),
+    'takamol_data_processing': ('src.data_extraction_and_processing.takamol.takamol_data_processing', 'main'),
+    'takamol_data_matcher': ('src.data_extraction_and_processing.takamol.takamol_data_matcher', 'main'),
+    'takamol_prepare_for_loading': ('src.data_extraction_and_processing.takamol.takamol_prepare_for_loading',
+                                    'main'),
+    'google_sheets_client': ('src.data_extraction_and_processing.docs_google.google_sheets_client', 'main'),
+    'google_sheets_data_matcher': ('src.data_extraction_and_processing.docs_google.google_sheets_data_matcher',
+                                   'main'),
+    'google_sheets_prepare_for_loading': (
+        'src.data_extraction_and_processing.docs_google.google_sheets_prepare_for_loading', 'main'),
+    'create_holds': ('src.data_extraction_and_processing.ya.create_holds', 'main'),
+}
+
+
+def load_stage(stage_name):
+    module_name, function_name = STAGES[stage_name]
+    # модуль попадает в sys.modules в начале импорта: параллельный поток должен дождаться его инициализации
+    # на блокировке импорта, поэтому import_module вызывается всегда
+    imported = module_name in sys.modules
+    started = time.perf_counter()
+    module = importlib.import_module(module_name)
+    if not imported:
+        metrics.set('pipeline_stage_import_seconds', time.perf_counter() - started, stage=stage_name)
+    return getattr(module, function_name)
+
+
+def run_stage(company_name, stage_name, context, *args, **kwargs):
+    stage = load_stage(stage_name)
+    with metrics.stage(company_name, stage_name, context):
+        return stage(company_name, *args, context, **kwargs)
+
+
+def get_next_booking_since(context):
+    # ближайшее будущее начало брони или холда - по нему демон решает, насколько часто обновлять компанию
+    import pandas as pd
+    now = time.time()
+    starts = []
+    for key, column in (('yango_bookings', 'since'), ('ready_to_load', 'current_since')):
+        data = context.frames.get(key)
+        if data is not None and column in data:
+            since = pd.to_numeric(data[column], errors='coerce')
+            starts.extend(since[since > now].tolist())
+    return float(min(starts)) if starts else None
 
 
 def process_company(company_name, company_config):
     if company_name in ["AL EMAD CAR RENTAL", "CAR STREET CAR RENTAL"]:
         logger.info(f"<{company_name}> skip...")
-        return
+        return {"company": company_name, "status": "skipped", "duration": 0.0, "error": None}
+    from src.data_helper import PipelineContext
+    config = get_config()
+    started = time.perf_counter()
     logger.info(f"<{company_name}> start processing data...")
     token_drive_ya_tech = company_config['TOKEN_DRIVE_YA_TECH']
     tag_name = company_config['tag_name']
     takamol_member_no = company_config.get('TAKAMOL_MemberNo')
     config_google_sheets = company_config.get('config_google_sheets')
+    context = PipelineContext(company_name, logger, persist=config.get("persist_artifacts", True),
+                              load_from_disk=False)
     try:
         logger.debug(f"<{company_name}> Получаем бронирования и данные по машинам с ya...")
-        ya_get_cars_and_bookings_data.main(company_name, token_drive_ya_tech)
-        ya_data_join.merge_csv_files(company_name)
+        run_stage(company_name, 'ya_get_cars_and_bookings_data', context, token_drive_ya_tech)
+        run_stage(company_name, 'ya_data_join', context)
 
         if takamol_member_no:
             logger.debug(f"<{company_name}> Получение данных по бронированиям с takamol...")
-            takamol_get_car_bookings_data.main(company_name, takamol_member_no, TAKAMOL_API_KEY)
+            run_stage(company_name, 'takamol_get_car_bookings_data', context, takamol_member_no,
+                      config["TAKAMOL_API_KEY"])
 
             logger.debug(f"<{company_name}> Убираем дубли с takamol и оставляем уникальные авто...")
-            takamol_data_processing.main(company_name)
+            run_stage(company_name, 'takamol_data_processing', context)
 
             logger.debug(f"<{company_name}> Выполняем мэтч takamol и ya...")
-            takamol_data_matcher.main(company_name)
+            run_stage(company_name, 'takamol_data_matcher', context)
 
             logger.debug(f"<{company_name}> Выполняем подготовку к загрузке takamol и ya...")
-            takamol_prepare_for_loading.main(company_name)
+            run_stage(company_name, 'takamol_prepare_for_loading', context)
         elif config_google_sheets:
             logger.debug(f"<{company_name}> Получение данных по бронированиям с google_sheets...")
-            google_sheets_client.main(company_name, config_google_sheets)
+            run_stage(company_name, 'google_sheets_client', context, config_google_sheets)
 
             logger.debug(f"<{company_name}> Выполняем мэтч google_sheets и ya...")
-            google_sheets_data_matcher.main(company_name)
+            run_stage(company_name, 'google_sheets_data_matcher', context)
 
             logger.debug(f"<{company_name}> Выполняем подготовку к загрузке google_sheets и ya...")
-            google_sheets_prepare_for_loading.main(company_name)
+            run_stage(company_name, 'google_sheets_prepare_for_loading', context)
         else:
             logger.warning(f"<{company_name}> no data or processing method, "
                            f"check config - {company_config}")
 
         logger.info(f"<{company_name}> Ставим холды...")
-        create_holds.main(company_name, token_drive_ya_tech, tag_name)
+        run_stage(company_name, 'create_holds', context, token_drive_ya_tech, tag_name,
+                  max_in_flight=config.get("holds_max_in_flight"))
 
     except Exception as e:
         logger.error(f"<{company_name}> Error processing company: {e}")
+        return finish_company(company_name, "failed", started, error=str(e))
 
+    return finish_company(company_name, "ok", started, next_booking_since=get_next_booking_since(context))
 
-def main():
-    del_old_data.main()
-    rantal_companies = _config_json['ya_companies']
-    with ThreadPoolExecutor(max_workers=4) as executor:
-        futures = [executor.submit(process_company, company_name, company_config)
-                   for company_name, company_config in rantal_companies.items()]
 
-        for future in futures:
-            future.result()
+def finish_company(company_name, status, started, error=None, next_booking_since=None):
+    # метрики процесса уходят вместе с результатом: в режиме process воркер - отдельный процесс
+    duration = time.perf_counter() - started
+    metrics.set('pipeline_company_duration_seconds', duration, company=company_name)
+    metrics.inc('pipeline_company_runs_total', company=company_name, status=status)
+    return {"company": company_name, "status": status, "duration": duration, "error": error,
+            "next_booking_since": next_booking_since, "metrics": metrics.drain()}
+
+
+def get_requests_per_company(config):
+    # этапы компании идут последовательно: одновременных запросов к одному хосту не больше,
+    # чем у самого параллельного этапа - холды, окно пагинации ya или страницы takamol
+    from src.yango_client import PAGINATION_WINDOW
+    from src.data_extraction_and_processing.ya.create_holds import MAX_IN_FLIGHT_HOLDS
+    from src.data_extraction_and_processing.takamol.takamol_get_car_bookings_data import MAX_WORKERS
+    return max(config.get("holds_max_in_flight") or MAX_IN_FLIGHT_HOLDS, PAGINATION_WINDOW, MAX_WORKERS)
+
+
+def create_executor(executor_type, max_workers, requests_per_company):
+    # в режиме process каждая компания считается в отдельном процессе (spawn): конфиг и логирование
+    # инициализируются в процессе заново, а CPU-этапы не упираются в GIL
+    from src.http_transport import configure_pool
+    if executor_type == "process":
+        return ProcessPoolExecutor(max_workers=max_workers, mp_context=multiprocessing.get_context("spawn"),
+                                   initializer=configure_pool, initargs=(requests_per_company,))
+    configure_pool(max_workers * requests_per_company)
+    return ThreadPoolExecutor(max_workers=max_workers)
+
+
+def main(executor_type=None, max_workers=None):
+    config = get_config()
+    # по умолчанию компании считаются в потоках, как раньше; "process" включается в config.json
+    executor_type = executor_type or config.get("executor", "thread")
+    max_workers = max_workers or config.get("max_workers", 4)
+    del_old_data.main()
+    rantal_companies = config['ya_companies']
+    max_workers = max(1, min(max_workers, len(rantal_companies)))
+    logger.info(f"Processing {len(rantal_companies)} companies with {executor_type} pool of {max_workers} workers")
+    results = []
+    run_metrics = MetricsRegistry()
+    with create_executor(executor_type, max_workers, get_requests_per_company(config)) as executor:
+        futures = {company_name: executor.submit(process_company, company_name, company_config)
+                   for company_name, company_config in rantal_companies.items()}
+
+        for company_name, future in futures.items():
+            try:
+                results.append(future.result())
+            except Exception as e:
+                logger.error(f"<{company_name}> Worker failed: {e}")
+                results.append({"company": company_name, "status": "failed", "duration": 0.0, "error": str(e)})
+
+    for result in results:
+        logger.info(f"<{result['company']}> {result['status']} in {result['duration']:.1f}s")
+        run_metrics.merge(result.get('metrics'))
+    run_metrics.merge(metrics.drain())
+    try:
+        prometheus_file, summary_file = run_metrics.write()
+        logger.info(f"Metrics saved to {prometheus_file} and {summary_file}")
+    except IOError as e:
+        logger.error(f"Failed to save metrics: {e}")
+    failed = [result['company'] for result in results if result['status'] == "failed"]
+    if failed:
+        logger.error(f"Failed companies: {failed}")
+    return 1 if failed else 0
 
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
 
 # переделать под текущие реалии скрипт для поиска авто с активной бронью которых у нас нет
 # запихнуть все в докер и закинуть на сервер
@@ -0,0 +1,113 @@
+import os
+import json
+import threading
+import pandas as pd
+from src.settings import setup_logging
+from src.config import BASE_DIR
+
+script_name = os.path.splitext(os.path.basename(__file__))[0]
+logger = setup_logging(script_name)
+
+MATCH_SNAPSHOT_DIR = os.path.join(BASE_DIR, 'cache', 'matches')
+# меняется вместе с логикой матчеров и нормализации - старые снимки тогда не используются
+MATCH_SNAPSHOT_VERSION = 2
+
+_snapshots = {}
+_snapshots_lock = threading.Lock()
+
+
+def hash_rows(data, columns):
+    # хэш строки по колонкам, от которых зависит результат мэтча; остальные колонки на результат
+    # не влияют - записи мэтча собираются из текущих данных
+    if data.empty:
+        return []
+    return pd.util.hash_pandas_object(data.reindex(columns=columns).astype(str), index=False).tolist()
+
+
+def get_rows(data, positions):
+    # строки по позициям; без колонок (пустой источник) - сама таблица
+    return data.iloc[positions] if len(data.columns) else data
+
+
+class MatchSnapshot:
+    # результат мэтча прошлого запуска: для авто ya (id -> хэш ключевых колонок, нормализованные номер и
+    # производитель) и для строк источника (хэш ключевых колонок -> статус, id авто ya, нормализованные ключи).
+    # Нормализуются только новые и изменившиеся строки; результат строки переиспользуется, если ни одно
+    # добавленное, удаленное или изменившееся авто ya не подходит ей по номеру
+    def __init__(self, company_name, matcher, data=None):
+        self.company_name = company_name
+        self.matcher = matcher
+        data = data or {}
+        self.yango = data.get('yango', {})
+        self.results = data.get('results', {})
+        self.cache_file = os.path.join(MATCH_SNAPSHOT_DIR, f'{company_name}_{matcher}.json')
+
+    @classmethod
+    def load(cls, company_name, matcher):
+        with _snapshots_lock:
+            snapshot = _snapshots.get((company_name, matcher))
+        if snapshot is not None:
+            return snapshot
+        snapshot = cls(company_name, matcher)
+        try:
+            with open(snapshot.cache_file, mode='r', encoding='utf-8') as file:
+                data = json.load(file)
+            if data.get('version') == MATCH_SNAPSHOT_VERSION:
+                snapshot = cls(company_name, matcher, data)
+        except FileNotFoundError:
+            logger.debug(f"<{company_name}> Match snapshot {snapshot.cache_file} not found")
+        except (ValueError, KeyError) as e:
+            logger.warning(f"<{company_name}> Match snapshot {snapshot.cache_file} is broken: {e}")
+        return snapshot
+
+    @staticmethod
+    def get_yango_ids(yango_cars_data):
+        # без уникального id авто ya нельзя сопоставить со снимком - тогда мэтч полный
+        if 'id' not in yango_cars_data or not yango_cars_data['id'].is_unique or yango_cars_data['id'].isna().any():
+            return None
+        return yango_cars_data['id'].astype(str).tolist()
+
+    def sync_yango(self, yango_cars_data, yango_ids, yango_hashes, normalize):
+        # нормализованные ключи всех авто ya (для неизменившихся - из снимка, остальные через normalize)
+        # и ключи изменившихся авто: новые версии, а также старые версии измененных и удаленных
+        keys = [None] * len(yango_ids)
+        stale = []
+        for position, (car_id, row_hash) in enumerate(zip(yango_ids, yango_hashes)):
+            stored = self.yango.get(car_id)
+            if stored is not None and stored[0] == row_hash:
+                keys[position] = stored[1:]
+            else:
+                stale.append(position)
+        for position, key in zip(stale, normalize(get_rows(yango_cars_data, stale))):
+            keys[position] = key
+        current = dict(zip(yango_ids, yango_hashes))
+        changed = [keys[position] for position in stale]
+        changed.extend(values[1:] for car_id, values in self.yango.items() if current.get(car_id) != values[0])
+        return keys, changed
+
+    def get(self, source_hash):
+        return self.results.get(str(source_hash))
+
+    def reset(self):
+        # данные нельзя сопоставить со снимком (нет уникальных id авто ya) - старые результаты не переносятся
+        self.yango = {}
+        self.results = {}
+
+    def update(self, yango_ids, yango_hashes, yango_keys, source_hashes, results):
+        self.yango = {car_id: [row_hash, *key] for car_id, row_hash, key in zip(yango_ids, yango_hashes, yango_keys)}
+        self.results = {str(source_hash): result for source_hash, result in zip(source_hashes, results)}
+
+    def save(self, persist=True):
+        with _snapshots_lock:
+            _snapshots[(self.company_name, self.matcher)] = self
+        if not persist:
+            return
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        tmp_file = f"{self.cache_file}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_file, mode='w', encoding='utf-8') as file:
+                json.dump({'version': MATCH_SNAPSHOT_VERSION, 'yango': self.yango, 'results': self.results},
+                          file, default=str)
+            os.replace(tmp_file, self.cache_file)
+        except IOError as e:
+            logger.error(f"<{self.company_name}> Failed to save match snapshot: {e}")
@@ -0,0 +1,159 @@
+import os
+import json
+import time
+import bisect
+import threading
+from contextlib import contextmanager
+from src.config import BASE_DIR, get_current_datetime
+
+METRICS_DIR = os.path.join(BASE_DIR, 'data', 'metrics')
+PROMETHEUS_FILE = 'metrics.prom'
+LATENCY_BUCKETS = (0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+
+def labels_key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def format_labels(key, extra=()):
+    pairs = list(key) + list(extra)
+    if not pairs:
+        return ''
+    escaped = (name + '="' + value.replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n') + '"'
+               for name, value in pairs)
+    return '{' + ','.join(escaped) + '}'
+
+
+class MetricsRegistry:
+    # метрики процесса: счетчики, последние значения и гистограммы с метками. Воркер отдает накопленное
+    # через drain() вместе с результатом компании, главный процесс складывает их через merge()
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.counters = {}
+        self.gauges = {}
+        self.histograms = {}
+
+    def inc(self, name, value=1, **labels):
+        key = (name, labels_key(labels))
+        with self.lock:
+            self.counters[key] = self.counters.get(key, 0) + value
+
+    def set(self, name, value, **labels):
+        with self.lock:
+            self.gauges[(name, labels_key(labels))] = value
+
+    def observe(self, name, value, buckets=LATENCY_BUCKETS, **labels):
+        key = (name, labels_key(labels))
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = {'buckets': list(buckets), 'counts': [0] * (len(buckets) + 1),
+                                                    'sum': 0.0, 'count': 0}
+            histogram['counts'][bisect.bisect_left(histogram['buckets'], value)] += 1
+            histogram['sum'] += value
+            histogram['count'] += 1
+
+    @contextmanager
+    def stage(self, company_name, stage_name, context):
+        # время этапа и число строк во всех данных, которые этап положил в context
+        before = {key: id(frame) for key, frame in context.frames.items()}
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            rows = sum(len(frame) for key, frame in context.frames.items() if before.get(key) != id(frame))
+            self.set('pipeline_stage_duration_seconds', time.perf_counter() - started,
+                     company=company_name, stage=stage_name)
+            self.set('pipeline_stage_rows', rows, company=company_name, stage=stage_name)
+
+    def drain(self):
+        with self.lock:
+            snapshot = {'counters': self.counters, 'gauges': self.gauges, 'histograms': self.histograms}
+            self.counters, self.gauges, self.histograms = {}, {}, {}
+        return snapshot
+
+    def merge(self, snapshot):
+        if not snapshot:
+            return
+        with self.lock:
+            for key, value in snapshot['counters'].items():
+                self.counters[key] = self.counters.get(key, 0) + value
+            self.gauges.update(snapshot['gauges'])
+            for key, other in snapshot['histograms'].items():
+                histogram = self.histograms.get(key)
+                if histogram is None:
+                    self.histograms[key] = {**other, 'counts': list(other['counts'])}
+                    continue
+                histogram['counts'] = [a + b for a, b in zip(histogram['counts'], other['counts'])]
+                histogram['sum'] += other['sum']
+                histogram['count'] += other['count']
+
+    def to_prometheus(self):
+        lines = []
+        with self.lock:
+            for metric_type, values in (('counter', self.counters), ('gauge', self.gauges)):
+                for name in sorted({name for name, _ in values}):
+                    lines.append(f'# TYPE {name} {metric_type}')
+                    for (metric_name, key), value in sorted(values.items()):
+                        if metric_name == name:
+                            lines.append(f'{name}{format_labels(key)} {value}')
+            for name in sorted({name for name, _ in self.histograms}):
+                lines.append(f'# TYPE {name} histogram')
+                for (metric_name, key), histogram in sorted(self.histograms.items()):
+                    if metric_name != name:
+                        continue
+                    cumulative = 0
+                    for bound, count in zip(histogram['buckets'] + ['+Inf'], histogram['counts']):
+                        cumulative += count
+                        lines.append(f'{name}_bucket{format_labels(key, [("le", str(bound))])} {cumulative}')
+                    lines.append(f'{name}_sum{format_labels(key)} {histogram["sum"]}')
+                    lines.append(f'{name}_count{format_labels(key)} {histogram["count"]}')
+        return '\n'.join(lines) + '\n'
+
+    def to_summary(self):
+        with self.lock:
+            summary = {
+                'counters': [{'name': name, 'labels': dict(key), 'value': value}
+                             for (name, key), value in sorted(self.counters.items())],
+                'gauges': [{'name': name, 'labels': dict(key), 'value': value}
+                           for (name, key), value in sorted(self.gauges.items())],
+                'histograms': [{'name': name, 'labels': dict(key), 'count': histogram['count'],
+                                'sum': histogram['sum'],
+                                'mean': histogram['sum'] / histogram['count'] if histogram['count'] else None}
+                               for (name, key), histogram in sorted(self.histograms.items())]
+            }
+            matcher_rows = {}
+            for (name, key), value in self.counters.items():
+                if name == 'matcher_rows_total':
+                    labels = dict(key)
+                    totals = matcher_rows.setdefault((labels['company'], labels['matcher']), {})
+                    totals[labels['result']] = totals.get(labels['result'], 0) + value
+        summary['matcher_hit_rates'] = [{'company': company, 'matcher': matcher,
+                                         'hit_rate': totals.get('matched', 0) / sum(totals.values())}
+                                        for (company, matcher), totals in sorted(matcher_rows.items())
+                                        if sum(totals.values())]
+        return summary
+
+    def write(self, directory=METRICS_DIR):
+        # metrics.prom перезаписывается атомарно (для node_exporter textfile), json - сводка за запуск
+        os.makedirs(directory, exist_ok=True)
+        prometheus_file = os.path.join(directory, PROMETHEUS_FILE)
+        tmp_file = f"{prometheus_file}.{os.getpid()}.tmp"
+        with open(tmp_file, mode='w', encoding='utf-8') as file:
+            file.write(self.to_prometheus())
+        os.replace(tmp_file, prometheus_file)
+        summary_file = os.path.join(directory, f'metrics_{get_current_datetime()}.json')
+        with open(summary_file, mode='w', encoding='utf-8') as file:
+            json.dump(self.to_summary(), file, indent=4, ensure_ascii=False)
+        return prometheus_file, summary_file
+
+
+def record_matcher_results(company_name, matcher, matched, multiple, failed, comparisons, reused=0):
+    metrics.inc('matcher_rows_total', matched, company=company_name, matcher=matcher, result='matched')
+    metrics.inc('matcher_rows_total', multiple, company=company_name, matcher=matcher, result='multiple')
+    metrics.inc('matcher_rows_total', failed, company=company_name, matcher=matcher, result='failed')
+    metrics.inc('matcher_comparisons_total', comparisons, company=company_name, matcher=matcher)
+    metrics.inc('matcher_rows_reused_total', reused, company=company_name, matcher=matcher)
+
+
+metrics = MetricsRegistry()
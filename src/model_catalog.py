@@ -0,0 +1,92 @@
+import os
+import json
+import time
+import hashlib
+import threading
+import pandas as pd
+from src.settings import setup_logging
+from src.config import BASE_DIR
+
+script_name = os.path.splitext(os.path.basename(__file__))[0]
+logger = setup_logging(script_name)
+
+MODEL_CATALOG_FILE = os.path.join(BASE_DIR, 'cache', 'yango_model_list.json')
+MODEL_CATALOG_TTL = 6 * 60 * 60
+MODEL_COLUMNS = {
+    'code': 'model_id',
+    'manufacturer': 'merge_manufacturer',
+    'short_name': 'merge_short_name',
+    'name': 'merge_name'
+}
+
+
+class ModelCatalogCache:
+    # каталог моделей одинаковый для всех компаний: один запрос на TTL, копия на диске,
+    # таблица для join по model_id пересобирается только при смене хэша содержимого
+    def __init__(self, cache_file=MODEL_CATALOG_FILE, ttl=MODEL_CATALOG_TTL):
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.lock = threading.Lock()
+        self.models = []
+        self.models_data = pd.DataFrame()
+        self.content_hash = None
+        self.fetched_at = 0.0
+
+    @staticmethod
+    def get_content_hash(models):
+        return hashlib.sha256(json.dumps(models, sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+
+    def is_fresh(self):
+        return bool(self.models) and time.time() - self.fetched_at < self.ttl
+
+    def update(self, models, fetched_at, content_hash=None):
+        content_hash = content_hash or self.get_content_hash(models)
+        if content_hash != self.content_hash:
+            self.models = models
+            self.models_data = pd.DataFrame(models).rename(columns=MODEL_COLUMNS)
+            self.content_hash = content_hash
+            logger.debug(f"Model catalog updated: {len(models)} models, hash {content_hash[:12]}")
+        self.fetched_at = fetched_at
+
+    def load_from_disk(self):
+        try:
+            with open(self.cache_file, mode='r', encoding='utf-8') as file:
+                cached = json.load(file)
+            self.update(cached['models'], cached['fetched_at'], cached.get('content_hash'))
+        except FileNotFoundError:
+            logger.debug(f"Model catalog cache {self.cache_file} not found")
+        except (ValueError, KeyError) as e:
+            logger.warning(f"Model catalog cache {self.cache_file} is broken: {e}")
+
+    def save_to_disk(self):
+        os.makedirs(os.path.dirname(self.cache_file), exist_ok=True)
+        tmp_file = f"{self.cache_file}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_file, mode='w', encoding='utf-8') as file:
+                json.dump({'fetched_at': self.fetched_at, 'content_hash': self.content_hash,
+                           'models': self.models}, file)
+            os.replace(tmp_file, self.cache_file)
+        except IOError as e:
+            logger.error(f"Failed to save model catalog cache: {e}")
+
+    def get_models(self, fetch_models):
+        with self.lock:
+            if not self.is_fresh():
+                self.load_from_disk()
+            if not self.is_fresh():
+                models = fetch_models()
+                if models:
+                    self.update(models, time.time())
+                    self.save_to_disk()
+                elif self.models:
+                    logger.warning(f"Failed to refresh model catalog, using cached copy from {self.fetched_at}")
+            return self.models
+
+    def get_models_data(self):
+        with self.lock:
+            if not self.models:
+                self.load_from_disk()
+            return self.models_data
+
+
+model_catalog = ModelCatalogCache()
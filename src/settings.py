@@ -1,7 +1,13 @@
 import logging
 import os
+import copy
+import queue
+import itertools
+import threading
+import multiprocessing
+import multiprocessing.util
 from src.config import get_current_datetime
-from logging.handlers import RotatingFileHandler
+from logging.handlers import RotatingFileHandler, QueueHandler, QueueListener
 
 BASE_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
 LOGGING_CONFIG = {
@@ -11,32 +17,140 @@ LOGGING_CONFIG = {
     "log_dir": os.path.join(BASE_DIR, 'logs'),
     "max_bytes": 1048576,
     "backup_count": 2,
-    "log_to_console": True
+    "log_to_console": True,
+    "sample_every": 100
 }
 
+_lock = threading.Lock()
+_listener = None
+_listener_pid = None
+_queue_handler = None
+_sample_counters = {}
 
-def setup_logging(script_name):
-    current_date_time = get_current_datetime()
-    log_level = getattr(logging, LOGGING_CONFIG.get("log_level", "INFO").upper(), logging.INFO)
 
-    logger = logging.getLogger(script_name)
-    logger.setLevel(log_level)
+def get_log_level():
+    return getattr(logging, LOGGING_CONFIG.get("log_level", "INFO").upper(), logging.INFO)
+
+
+class WatchedRotatingFileHandler(RotatingFileHandler):
+    # как WatchedFileHandler: если файл лога удалили или заменили (del_old_data в демоне или параллельном
+    # запуске), он открывается заново - иначе долгоживущий процесс пишет в удаленный файл
+    def emit(self, record):
+        if self.stream is not None:
+            try:
+                reopen = not os.path.samestat(os.stat(self.baseFilename), os.fstat(self.stream.fileno()))
+            except FileNotFoundError:
+                reopen = True
+            if reopen:
+                self.stream.close()
+                self.stream = None
+                os.makedirs(os.path.dirname(self.baseFilename), exist_ok=True)
+        super().emit(record)
+
+
+class ScriptFileRouter(logging.Handler):
+    # работает в потоке QueueListener: у каждого скрипта свой файл, открывается при первой записи
+    def __init__(self, level, formatter):
+        super().__init__(level)
+        self.setFormatter(formatter)
+        self.started_at = get_current_datetime()
+        self.handlers = {}
+
+    def get_handler(self, script_name):
+        handler = self.handlers.get(script_name)
+        if handler is None:
+            log_dir = os.path.join(LOGGING_CONFIG["log_dir"], script_name)
+            os.makedirs(log_dir, exist_ok=True)
+            # в дочерних процессах свой файл, чтобы процессы не писали и не ротировали один и тот же лог
+            pid_suffix = f'_{os.getpid()}' if multiprocessing.parent_process() is not None else ''
+            log_file = os.path.join(log_dir, f'{script_name}_{self.started_at}{pid_suffix}.log')
+            handler = WatchedRotatingFileHandler(log_file, maxBytes=LOGGING_CONFIG["max_bytes"],
+                                                 backupCount=LOGGING_CONFIG["backup_count"])
+            handler.setFormatter(self.formatter)
+            self.handlers[script_name] = handler
+        return handler
+
+    def emit(self, record):
+        self.get_handler(record.name).handle(record)
+
+    def close(self):
+        for handler in self.handlers.values():
+            handler.close()
+        super().close()
+
+
+class PreparedQueueHandler(QueueHandler):
+    # текст сообщения собирается в вызывающем потоке (аргументы могут успеть измениться),
+    # форматирование и запись в файлы - в фоновом потоке
+    def prepare(self, record):
+        record = copy.copy(record)
+        record.msg = record.getMessage()
+        record.args = None
+        if record.exc_info:
+            record.exc_text = logging.Formatter().formatException(record.exc_info)
+            record.exc_info = None
+        return record
 
-    log_dir = os.path.join(LOGGING_CONFIG["log_dir"], script_name)
-    os.makedirs(log_dir, exist_ok=True)
-    log_file = os.path.join(log_dir, f'{script_name}_{current_date_time}.log')
 
-    fh = RotatingFileHandler(log_file, maxBytes=LOGGING_CONFIG["max_bytes"], backupCount=LOGGING_CONFIG["backup_count"])
-    fh.setLevel(log_level)
+class LazyQueueHandler(logging.Handler):
+    # ставится на логгеры при импорте модулей: очередь и фоновый поток запускаются при первой записи,
+    # поэтому импорт модуля, который так ничего и не залогировал, не создает ни потоков, ни файлов
+    def handle(self, record):
+        return start_logging().handle(record)
 
-    if LOGGING_CONFIG["log_to_console"]:
-        ch = logging.StreamHandler()
-        ch.setLevel(log_level)
-        ch.setFormatter(logging.Formatter(LOGGING_CONFIG["log_format"], datefmt=LOGGING_CONFIG["date_format"]))
-        logger.addHandler(ch)
+    def emit(self, record):
+        start_logging().emit(record)
 
-    formatter = logging.Formatter(LOGGING_CONFIG["log_format"], datefmt=LOGGING_CONFIG["date_format"])
-    fh.setFormatter(formatter)
 
-    logger.addHandler(fh)
+_lazy_handler = LazyQueueHandler()
+
+
+def start_logging():
+    # одна очередь и один фоновый поток записи на процесс, сколько бы модулей ни вызывали setup_logging
+    global _listener, _listener_pid, _queue_handler
+    with _lock:
+        if _listener is None or _listener_pid != os.getpid():
+            log_level = get_log_level()
+            formatter = logging.Formatter(LOGGING_CONFIG["log_format"], datefmt=LOGGING_CONFIG["date_format"])
+            handlers = [ScriptFileRouter(log_level, formatter)]
+            if LOGGING_CONFIG["log_to_console"]:
+                ch = logging.StreamHandler()
+                ch.setLevel(log_level)
+                ch.setFormatter(formatter)
+                handlers.append(ch)
+            log_queue = queue.SimpleQueue()
+            _listener = QueueListener(log_queue, *handlers, respect_handler_level=True)
+            _listener.start()
+            _listener_pid = os.getpid()
+            _queue_handler = PreparedQueueHandler(log_queue)
+            # финализаторы multiprocessing выполняются и при обычном выходе, и в дочерних процессах пула
+            multiprocessing.util.Finalize(None, stop_logging, exitpriority=0)
+        return _queue_handler
+
+
+def stop_logging():
+    global _listener
+    with _lock:
+        if _listener is not None:
+            _listener.stop()
+            for handler in _listener.handlers:
+                handler.close()
+            _listener = None
+
+
+def setup_logging(script_name):
+    logger = logging.getLogger(script_name)
+    if _lazy_handler not in logger.handlers:
+        logger.setLevel(get_log_level())
+        logger.addHandler(_lazy_handler)
     return logger
+
+
+def log_sampled(logger, key, msg, *args, level=logging.DEBUG, every=None):
+    # построчный debug-вывод: пишется только каждая every-я запись с данным ключом
+    if not logger.isEnabledFor(level):
+        return
+    every = every or LOGGING_CONFIG["sample_every"]
+    counter = _sample_counters.setdefault((logger.name, key), itertools.count())
+    if next(counter) % every == 0:
+        logger.log(level, msg, *args)
@@ -1,9 +1,18 @@
 import requests
-from requests.adapters import HTTPAdapter
-from urllib3.util.retry import Retry
+import pandas as pd
 import logging
 import traceback
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
 from urllib.parse import urlencode
+from src.http_transport import create_session
+from src.json_stream import iter_grouped_items, CHUNK_SIZE
+from src.data_helper import ColumnarBuilder
+from src.settings import log_sampled
+
+PAGINATION_WINDOW = 4
+# ответ add_hold_car на 409: такой холд у авто уже стоит
+HOLD_EXISTS = 'hold_exists'
 
 
 class YangoAPIClient:
@@ -12,44 +21,53 @@ class YangoAPIClient:
         self.session = self.create_session(token)
         self.logger = logger
 
-    def create_session(self, token: str):
-        retries = Retry(total=5, backoff_factor=1, status_forcelist=[429, 500, 502, 503, 504])
-        session = requests.Session()
-        session.mount('http://', HTTPAdapter(max_retries=retries))
-        session.headers.update({'Authorization': f'Bearer {token}'})
-        return session
+    @staticmethod
+    def create_session(token: str):
+        return create_session({'Authorization': f'Bearer {token}'})
 
     def fetch_bookings(self, endpoint: str, params=None):
         url = f"{self.base_url}/{endpoint}"
         try:
-            self.logger.debug(f"Sending request to {url} with params: {params}")
-            response = self.session.get(url, params=params)
-            self.logger.debug(f"Request URL: {response.url}, Status Code: {response.status_code}")
-            response.raise_for_status()
-            offers_timetable = response.json().get('offers_timetable', {})
-            bookings = []
-            for id_car, sublist in offers_timetable.items():
-                for item in sublist:
-                    item.update({'id_car': id_car})
+            self.logger.debug("Sending request to %s with params: %s", url, params)
+            # расписание на -10..+180 дней разбирается из тела ответа потоком, по одной брони
+            with self.session.get(url, params=params, stream=True) as response:
+                self.logger.debug("Request URL: %s, Status Code: %s", response.url, response.status_code)
+                response.raise_for_status()
+                bookings = ColumnarBuilder()
+                for id_car, item in iter_grouped_items(response.iter_content(chunk_size=CHUNK_SIZE),
+                                                       'offers_timetable'):
+                    item['id_car'] = id_car
                     bookings.append(item)
             self.logger.debug(f"Fetched {len(bookings)} bookings")
-            return bookings
-        except requests.exceptions.RequestException as e:
+            return bookings.to_dataframe()
+        except (requests.exceptions.RequestException, ValueError) as e:
             self.logger.error(f"Failed to fetch bookings: {e}")
-            return []
+            return pd.DataFrame()
 
     def fetch_model_list(self, endpoint: str):
         url = f"{self.base_url}/{endpoint}?lang=en"
         try:
             response = self.session.get(url)
-            self.logger.debug(f"Request URL: {response.url}, Status Code: {response.status_code}")
+            self.logger.debug("Request URL: %s, Status Code: %s", response.url, response.status_code)
             response.raise_for_status()
             return response.json().get('models', [])
         except requests.exceptions.RequestException as e:
             self.logger.error(f"Failed to fetch model list: {e}")
             return []
 
-    def fetch_all_cars_with_pagination(self, endpoint: str, initial_params=None):
+    def fetch_cars_page(self, endpoint: str, params: dict, page_number: int):
+        params = dict(params, page_number=page_number)
+        try:
+            response = self.session.get(f"{self.base_url}/{endpoint}", params=params)
+            self.logger.debug("Request URL: %s, Status Code: %s", response.url, response.status_code)
+            response.raise_for_status()
+            return response.json().get('cars', [])
+        except requests.exceptions.RequestException as e:
+            self.logger.error(f"Failed to fetch data for page {page_number}: {e}")
+            return None
+
+    def fetch_all_cars_with_pagination(self, endpoint: str, initial_params=None, window: int = PAGINATION_WINDOW,
+                                       sink=None):
         if initial_params is None:
             initial_params = {
                 "page_size": 50,
@@ -58,23 +76,27 @@ class YangoAPIClient:
 
         all_cars = []
         params = initial_params.copy()
-        page_number = 1
         self.logger.debug(f"start fetch_all_cars_with_pagination")
-        while True:
-            params['page_number'] = page_number
-            try:
-                response = self.session.get(f"{self.base_url}/{endpoint}", params=params)
-                self.logger.debug(f"Request URL: {response.url}, Status Code: {response.status_code}")
-                response.raise_for_status()
-                cars = response.json().get('cars', [])
+        # страницы запрашиваются с опережением на window штук, результат собирается строго по порядку;
+        # с sink каждая страница сразу уходит в него, а не копится в списке
+        with ThreadPoolExecutor(max_workers=max(1, window)) as executor:
+            in_flight = deque()
+            next_page = sink.next_page if sink else 1
+            while True:
+                while len(in_flight) < max(1, window):
+                    in_flight.append((next_page, executor.submit(self.fetch_cars_page, endpoint, params, next_page)))
+                    next_page += 1
+                page_number, future = in_flight.popleft()
+                cars = future.result()
                 if not cars:
+                    for _, pending in in_flight:
+                        pending.cancel()
                     break
-                self.logger.debug(f"number of cars-{len(cars)} in page={page_number}")
-                all_cars.extend(cars)
-                page_number += 1
-            except requests.exceptions.RequestException as e:
-                self.logger.error(f"Failed to fetch data for page {page_number}: {e}")
-                break
+                self.logger.debug("number of cars-%s in page=%s", len(cars), page_number)
+                if sink:
+                    sink.append_page(page_number, cars)
+                else:
+                    all_cars.extend(cars)
 
         return all_cars
 
@@ -84,18 +106,19 @@ class YangoAPIClient:
             url = f"{url}?{urlencode(string_params)}"
         try:
             response = self.session.post(url, json=params)
-            self.logger.debug(f"Request URL: {response.url}, Status Code: {response.status_code}")
+            log_sampled(self.logger, 'add_hold_car', "Request URL: %s, Status Code: %s", response.url,
+                        response.status_code)
             if response.status_code == 200:
                 self.logger.info("Tag successfully added to car")
                 return response.json()
             elif response.status_code == 409:
                 self.logger.warning(f"Processing existing records - {response.json()}")
-                return None
+                return HOLD_EXISTS
             else:
                 response.raise_for_status()
         except requests.exceptions.RequestException as e:
             self.logger.error(f"Failed to add tag: {e} with params {params}")
-            self.logger.debug(f"Traceback: {traceback.format_exc()}")
+            self.logger.debug("Traceback: %s", traceback.format_exc())
             return None
 
     def add_fake_car(self, endpoint: str, car_id: str):
@@ -106,7 +129,7 @@ class YangoAPIClient:
         try:
             self.logger.info(f"Adding 'fake_car' tag to car {car_id}")
             response = self.session.post(f"{url}?{urlencode(string_params)}", json=params)
-            self.logger.debug(f"Request URL: {response.url}, Status Code: {response.status_code}")
+            self.logger.debug("Request URL: %s, Status Code: %s", response.url, response.status_code)
             if response.status_code == 200:
                 self.logger.info(f"'fake_car' tag successfully added to car {car_id}")
                 return response.json()